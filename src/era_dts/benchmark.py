@@ -8,17 +8,35 @@ parser = argparse.ArgumentParser()
 parser.add_argument('-dte', '--dead-time-extraction', choices=['NONE', 'LC', 'DTS'], default='DTS', type=str.upper, help='The method for dead time extraction. Either the proposed dead time splitting method (DTS), extracting least-common dead time (LS), or no extraction (NONE). Defaults to DTS.', dest='dte')
 parser.add_argument('-t', '--tolerances', type=float, nargs='+', default=(-1, -3, -6, -9, -12, -15, -18, -21, -24), help='Bound for the relative error of the constructed model in dB.', dest='tols')
 parser.add_argument('-md', '--model-dir', type=Path, help='Directory where the models are stored.', default='models', dest='model_dir')
+parser.add_argument('-sc', '--spectrum-cache', type=Path, help='Directory where the spectra of the Hankel operators are cached across runs. Disabled by default.', default=None, dest='spectrum_cache')
+parser.add_argument('-mm', '--max-memory', type=float, help='Memory budget in GiB for the FFT workspace of the Hankel matrix-vector products. The samples are then processed in chunks. Unbounded by default.', default=None, dest='max_memory')
+parser.add_argument('-np', '--processes', type=int, help='Number of worker processes for the Hankel matrix-vector products, which share the data through shared memory. The numba threads are split between them. Disabled by default.', default=None, dest='processes')
+parser.add_argument('-nl', '--num-left', type=int, help='Number of output directions for a tangential projection of the Markov parameters before ERA. Disabled by default.', default=None, dest='num_left')
+parser.add_argument('-nr', '--num-right', type=int, help='Number of input directions for a tangential projection of the Markov parameters before ERA. Disabled by default.', default=None, dest='num_right')
+parser.add_argument('-c', '--compression', choices=['gzip', 'lzf'], help='Compression of the reduced order models in the results store. Disabled by default.', default=None, dest='compression')
+parser.add_argument('-r', '--resume', action='store_true', help='Resume from the checkpoint of an interrupted run in the model directory.', dest='resume')
+parser.add_argument('-p', '--profile', action='store_true', help='Profile the run with cProfile and write the statistics to profile.prof in the model directory.', dest='profile')
 scenario_parsers = parser.add_subparsers(dest='dataset', description='The dataset to use.', help=f'Use "{__file__} {{MIRACLE,MIRD}} -h" to list available scenarios.')
 miracle_parser = scenario_parsers.add_parser('MIRACLE', help='Microphone Array Impulse Repsonse Database for Acoustic Learning.')
 mird_parser = scenario_parsers.add_parser('MIRD', help='Multi-Channel Impulse Response Database.')
+batch_parser = scenario_parsers.add_parser('BATCH', help='Run several benchmarks in parallel processes.')
 
 miracle_parser.add_argument('-s', '--scenario', choices=['D1', 'A1', 'A1-C1', 'A2', 'A2-C1', 'R2', 'R2-C1'], type=str.upper, help='The scenario to consider.')
 mird_parser.add_argument('-s', '--scenario', choices=['SHORT3', 'MID3', 'LONG3', 'SHORT4', 'MID4', 'LONG4', 'SHORT8', 'MID8', 'LONG8'], type=str.upper, help='The scenario to consider. SHORT MID LONG refers to the different T60s, the last digit refers to the inter-microphone spacings of the microphone array.')
 
-args = parser.parse_args()
+batch_parser.add_argument('jobs', nargs='+', help='The benchmarks to run, specified as DATASET/SCENARIO-DTE, e.g. MIRACLE/A1-C1-DTS. The option --dead-time-extraction is ignored.')
+batch_parser.add_argument('-j', '--num-jobs', type=int, default=1, help='Maximal number of benchmarks running in parallel. The CPU threads are split evenly between them. Defaults to 1.', dest='num_jobs')
+batch_parser.add_argument('-mo', '--max-order', type=int, default=None, help='Largest order assumed when predicting the memory of the range finder bases. Defaults to the rank of the Hankel matrix.', dest='max_order')
+batch_parser.add_argument('-mb', '--memory-budget', type=float, default=None, help='Memory budget in GiB. Benchmarks are only started if their predicted peak memory fits into the budget. Unbounded by default.', dest='memory_budget')
 
 
 def run():
+    # arguments are parsed before any heavy imports, so that the help is printed instantly
+    args = parser.parse_args()
+    if args.dataset == 'BATCH':
+        from era_dts.scheduler import run_batch
+        run_batch(**{key: value for key, value in vars(args).items() if key not in ('dataset', 'dte')})
+        return
     from era_dts.construct import construct
     from pymor.tools.random import new_rng
     with new_rng(0):
@@ -3,6 +3,7 @@
 import numpy as np
 from scipy.fft import set_workers
 import scipy.linalg as spla
+from cProfile import Profile
 from pathlib import Path
 from time import perf_counter
 
@@ -10,9 +11,10 @@ from pymor.core.logger import set_log_levels
 from pymor.tools.random import new_rng
 
 from era_dts.downloader import fetch_data
-from era_dts.dead_time_extraction import extract_dead_times
-from era_dts.utils import impulse_response
+from era_dts.dead_time_extraction import dead_time_cache, extract_dead_times
+from era_dts.utils import impulse_response_error
 from era_dts.era import RandomizedERAReductor
+from era_dts import perf, results
 
 
 set_log_levels({
@@ -26,59 +28,85 @@ rrf_opts = {'block_size': 5, 'power_iterations': 2, 'qr_method': 'shifted_chol_q
 era_opts = {'force_stability': False, 'rrf_opts': rrf_opts}
 
 
-def construct(dataset, scenario, dte, tols, model_dir, dist=None):
+def construct(dataset, scenario, dte, tols, model_dir, spectrum_cache=None, max_memory=None, resume=False, workers=20,
+              processes=None, num_left=None, num_right=None, compression=None, profile=False, dist=None):
     model_dir = Path(model_dir) / dataset.upper() / (scenario + f'-{dte}')
     model_dir.mkdir(parents=True, exist_ok=True)
+    if profile:
+        # the profile is written next to the models, e.g. for inspection with snakeviz
+        with Profile() as profiler:
+            construct(dataset, scenario, dte, tols, model_dir.parent.parent, spectrum_cache=spectrum_cache,
+                      max_memory=max_memory, resume=resume, workers=workers, processes=processes,
+                      num_left=num_left, num_right=num_right, compression=compression, dist=dist)
+        profiler.dump_stats(model_dir / 'profile.prof')
+        return
+    perf.reset()
 
     tols = 10**(np.array(tols)/20)
+    max_memory = None if max_memory is None else int(max_memory * 2**30)
 
     # Load Data
-    data = fetch_data(dataset, scenario)
-    ir, fs, rpos, spos = data['ir'], data['fs'], data['rpos'], data['spos']
-    ir = ir.astype(dtype)
+    with perf.phase('load'):
+        data = fetch_data(dataset, scenario)
+        ir, fs, rpos, spos = data['ir'], data['fs'], data['rpos'], data['spos']
+        # the processed data is memory mapped, only convert if it is not stored in the target dtype
+        ir = ir.astype(dtype, copy=False)
 
     tic = perf_counter()
 
     # Dead Time Extraction
-    irm = extract_dead_times(ir, rpos, spos, fs, dte)
+    with perf.phase('dead_time_extraction'):
+        irm, do, di = extract_dead_times(ir, rpos, spos, fs, dte, cache_dir=dead_time_cache)
 
     # Run main identification loop
-    orders, err_true, err_est, err_kung = [], [], [], []
+    orders = []
     irnorm = spla.norm(irm)
-    era = RandomizedERAReductor(irm[1:], 1/fs, feedthrough=irm[0], **era_opts)
-    with (set_workers(20), new_rng(0)):
-        for tol in tols:
-            rom = era.reduce(tol=tol)
+    with perf.phase('setup'):
+        era = RandomizedERAReductor(irm[1:], 1/fs, feedthrough=irm[0], spectrum_cache=spectrum_cache,
+                                    max_memory=max_memory, processes=processes, num_left=num_left,
+                                    num_right=num_right, **era_opts)
+    if num_left is not None or num_right is not None:
+        print(f'projection error:\t{era.projection_errors[0]:.5f} (left), {era.projection_errors[1]:.5f} (right)\n')
+    # everything needed for the tables is stored with the results, so that they can be exported without the data,
+    # the store is opened after the setup, so that it is not left open if the setup fails
+    with (results.create(model_dir / 'results.h5', resume=resume, dataset=dataset, scenario=scenario, dte=dte,
+                         shape=irm.shape, fs=fs, irnorm=irnorm, output_dead_times=do, input_dead_times=di,
+                         num_left=num_left, num_right=num_right,
+                         projection_errors=np.array(era.projection_errors)) as store,
+          set_workers(workers), new_rng(0)):
+        sweep = era.sweep(tols=tols, block_size=block_size, checkpoint=model_dir / 'checkpoint.npz', resume=resume)
+        for rom, hsv, est, kung in sweep:
             orders.append(rom.order)
-            hm = impulse_response(rom.with_(T=ir.shape[0]))
-            err_true.append(spla.norm(irm-hm))
-            err_est.append(era._rrf.estimate_error()/era._weighted_h2_norm())
-            err_kung.append(era.error_bounds()[-1])
+            with perf.phase('error'):
+                err_true = impulse_response_error(rom, irm)
 
             print(f'order:\t\t\t{orders[-1]}')
             print(f'elapsed time:\t{perf_counter()-tic:.1f} s')
-            print(f'est. error:\t{err_est[-1]:.5f}')
-            print(f'rel. error:\t{err_true[-1]/irnorm:.5f}')
+            print(f'est. error:\t{est:.5f}')
+            print(f'rel. error:\t{err_true/irnorm:.5f}')
             print('\n')
 
-            # save results
-            model_file = (model_dir / f'rom_{orders[-1]}').with_suffix('.mat')
-            rom.to_mat_file(model_file)
-            np.save(model_dir / f'hsv_{orders[-1]}', rom.hsv())
-            np.save(model_dir / 'orders', np.array(orders))
-            np.save(model_dir / 'err_true', np.array(err_true))
-            np.save(model_dir / 'err_relative', np.array(err_true)/irnorm)
-            np.save(model_dir / 'err_est', np.array(err_est))
-            np.save(model_dir / 'err_kung', np.array(err_kung)/irnorm)
-
-            # adapt block size
-            if rom.order < 50:
-                era._rrf.block_size = 5
-            elif rom.order < 100:
-                era._rrf.block_size = 10
-            elif rom.order < 400:
-                era._rrf.block_size = 50
-            elif rom.order < 1000:
-                era._rrf.block_size = 100
-            else:
-                era._rrf.block_size = 250
+            # append the model and its metrics to the results
+            with perf.phase('io'):
+                results.append(store, rom, hsv, compression=compression, err_true=err_true,
+                               err_relative=err_true/irnorm, err_est=est, err_kung=kung/irnorm,
+                               elapsed=perf_counter()-tic)
+            perf.write(model_dir / 'perf.json', dataset=dataset, scenario=scenario, dte=dte, shape=irm.shape,
+                       dtype=irm.dtype.name, workers=workers, orders=orders, elapsed=perf_counter()-tic)
+
+    # all results are written, so the state of the range finder is not needed anymore
+    (model_dir / 'checkpoint.npz').unlink(missing_ok=True)
+
+
+def block_size(order):
+    # adapt the block size of the range finder to the current basis size
+    if order < 50:
+        return 5
+    elif order < 100:
+        return 10
+    elif order < 400:
+        return 50
+    elif order < 1000:
+        return 100
+    else:
+        return 250
@@ -1,51 +1,90 @@
 #!/usr/bin/env python3
 
+import hashlib
+import os
 import numpy as np
 import scipy.sparse as sps
 import scipy.optimize as spo
 
+from pathlib import Path
+
 from era_dts.utils import estimate_dead_times, apply_dead_times
 
 
-def split_dead_times(deltas, subsample=False):
-    # construct A matrix for linear program
+# directory where run-benchmark stores the solutions of the dead time splitting problem
+dead_time_cache = Path('processed') / 'dead_times'
+
+
+def split_dead_times(deltas, subsample=False, cache_dir=None):
+    # the solution of the linear program is only cached if a directory is given
+    # the larger dimension comes first in the linear program
     p, m = deltas.shape
-    A = sps.lil_array((m*p, m+p))
-    if p > m:
-        for i in range(p):
-            A[i*m:(i+1)*m, i] = np.ones(m)
-            A[i*m:(i+1)*m, p:] = np.eye(m)
-        d = deltas.ravel(order='C')
-        split = p
-    else:
-        for i in range(m):
-            A[i*p:(i+1)*p, i] = np.ones(p)
-            A[i*p:(i+1)*p, m:] = np.eye(p)
-        A = sps.csr_array(A)
-        d = deltas.T.ravel(order='C')
-        split = m
+    D = deltas if p > m else deltas.T
 
-    c = -np.ones(m+p)
-    x = spo.linprog(c, A_ub=A, b_ub=d, method='highs-ipm')['x']
+    if cache_dir is not None:
+        key = hashlib.blake2b(repr((D.shape, D.dtype.str, p > m)).encode(), digest_size=20)
+        key.update(np.ascontiguousarray(D))
+        path = Path(cache_dir) / f'{key.hexdigest()}.npy'
+    if cache_dir is not None and path.exists():
+        x = np.load(path)
+    else:
+        x = _solve_split_lp(D)
+        if cache_dir is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmpfile, 'wb') as f:
+                np.save(f, x)
+            os.replace(tmpfile, path)
 
     if not subsample:
         x = x.astype(int)
 
     if p > m:
-        do, di = np.split(x, [split])
+        do, di = np.split(x, [p])
         return do - np.min(do), di + np.min(do)
     else:
-        di, do = np.split(x, [split])
+        di, do = np.split(x, [m])
         return do + np.min(di), di - np.min(di)
 
 
-def extract_dead_times(ir, rpos, spos, fs, method):
-    if method == 'NONE':
-        return ir
+def _solve_split_lp(D, tol=1e-6):
+    # maximize the sum of the split dead times a_i + b_j <= D_ij by constraint generation
+    # only a few constraints are binding, so the LP is solved on a growing subset of them
+    q, r = D.shape
+    c = -np.ones(q+r)
+    active = np.zeros((q, r), dtype=bool)
+    # start with the smallest dead time of each row and column, which bounds every variable
+    active[np.arange(q), np.argmin(D, axis=1)] = True
+    active[np.argmin(D, axis=0), np.arange(r)] = True
+    while True:
+        i, j = np.nonzero(active)
+        rows = np.repeat(np.arange(len(i)), 2)
+        cols = np.stack([i, q+j], axis=1).ravel()
+        A = sps.csr_array((np.ones(2*len(i)), (rows, cols)), shape=(len(i), q+r))
+        x = spo.linprog(c, A_ub=A, b_ub=D[i, j], method='highs')['x']
+        violated = np.add.outer(x[:q], x[q:]) > D + tol
+        if not violated.any():
+            return x
+        active |= violated
+
+
+def dead_times(rpos, spos, fs, method, cache_dir=None):
+    # output and input dead times, the outer sum of which is extracted from the impulse responses
     d = estimate_dead_times(rpos, spos, 343, fs, subsample=False)
-    if method == 'LC':
-        dest = np.ones_like(d)*np.min(d)
+    p, m = d.shape
+    if method == 'NONE':
+        return np.zeros(p, dtype=int), np.zeros(m, dtype=int)
+    elif method == 'LC':
+        return np.full(p, np.min(d)).astype(int), np.zeros(m, dtype=int)
     elif method == 'DTS':
-        do, di = split_dead_times(d, subsample=True)
-        dest = np.add.outer(do, di)
-    return apply_dead_times(ir, -dest.astype(int))
+        do, di = split_dead_times(d, subsample=True, cache_dir=cache_dir)
+        return do, di
+
+
+def extract_dead_times(ir, rpos, spos, fs, method, cache_dir=None):
+    # the dead times are returned with the impulse responses, so that they are only computed once
+    do, di = dead_times(rpos, spos, fs, method, cache_dir=cache_dir)
+    if method == 'NONE':
+        return ir, do, di
+    # the Hankel operator is assembled from time slices, so return them contiguous
+    return apply_dead_times(ir, -np.add.outer(do, di).astype(int), order='C'), do, di
@@ -4,7 +4,10 @@ import numpy as np
 import h5py as h5
 import os
 import pooch
+import shutil
 
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 from scipy.io import loadmat
 from zipfile import ZipFile
@@ -12,6 +15,15 @@ from zipfile import ZipFile
 
 poochlog = pooch.get_logger()
 
+# arrays that are memory mapped instead of read into memory
+mmap_keys = ('ir', 'noise')
+# dtype of the processed impulse responses
+dtype = np.float32
+# subsampled source grids of the MIRACLE scenarios, the sources are arranged on a 64x64 grid
+miracle_grids = {
+    'C1': np.arange(4096).reshape(64, 64)[::2, ::2].ravel(),
+}
+
 
 miracle = pooch.create(
     base_url='https://depositonce.tu-berlin.de/bitstreams/',
@@ -62,72 +74,140 @@ mird = pooch.create(
 def process(func):
     def check_process(fname, action, pup):
         fname = Path(fname)
-        outfile = (Path('processed') / fname.parent.name / fname.stem).with_suffix('.npz')
-        if outfile.exists() and action == 'fetch':
-            poochlog.info(f"Processed file '{outfile}' exists and is up to date.")
-            return outfile
+        outdir = Path('processed') / fname.parent.name / fname.stem
+        if outdir.exists() and action == 'fetch':
+            poochlog.info(f"Processed directory '{outdir}' exists and is up to date.")
+            return outdir
         else:
-            poochlog.info(f"Processing file '{fname}' and writing to '{outfile}'.")
-            outfile.parent.mkdir(parents=True, exist_ok=True)
-            return func(fname, outfile)
+            poochlog.info(f"Processing file '{fname}' and writing to '{outdir}'.")
+            # write to a temporary directory first, so that an interrupted run is not mistaken as processed
+            # and concurrent runs do not write to the same files
+            tmpdir = outdir.with_name(f'{outdir.name}.{os.getpid()}.tmp')
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            tmpdir.mkdir(parents=True)
+            func(fname, tmpdir)
+            if action != 'fetch':
+                shutil.rmtree(outdir, ignore_errors=True)
+            try:
+                os.replace(tmpdir, outdir)
+            except OSError:
+                poochlog.info(f"Processed directory '{outdir}' was written by another process.")
+                shutil.rmtree(tmpdir)
+            return outdir
     return check_process
 
 
 @process
-def process_miracle(infile, outfile):
+def process_miracle(infile, outdir, block=64):
     with h5.File(infile, 'r') as f:
-        ir = f.get('data')['impulse_response'][()]
         fs = f.get('metadata')['sampling_rate'][()]
         spos = f.get('data')['location']['source'][()]
         rpos = f.get('data')['location']['receiver'][()]
-    np.savez(outfile, ir=ir.T, fs=fs, spos=spos, rpos=rpos)
-    return outfile
+        # copy the IRs in hyperslabs of sources, so that the full dataset is never held in memory
+        dset = f.get('data')['impulse_response']
+        m, p, T = dset.shape
+        ir = np.lib.format.open_memmap(outdir / 'ir.npy', mode='w+', dtype=dtype, shape=(T, p, m), fortran_order=True)
+        for j in range(0, m, block):
+            ir[..., j:j+block] = dset[j:j+block].T
+        ir.flush()
+    save(outdir, fs=fs, spos=spos, rpos=rpos)
+    return outdir
 
 
 @process
-def process_mird(infile, outfile):
-    ir = np.empty((26, 8, 480000))
-    spos = np.empty((26, 3))
-    rpos = np.empty((8, 3))
-    height = 1.2  # estimated from figure, as the paper does not say
+def process_mird(infile, outdir):
     with ZipFile(infile, "r") as zip_file:
-        for i, n in enumerate(zip_file.namelist()):
-            d = n.split('_')[-4:]
-            r, phi = float(d[2][0]), 2*np.pi*float(d[3][:3])/360
-            spos[i] = r*np.sin(phi), r*np.cos(phi), height
-            with open('tmp', 'wb') as tmpfile:
-                tmpfile.write(zip_file.open(n).read())
-            ir[i] = loadmat('tmp')['impulse_response'].T
-    os.remove('tmp')
+        names = zip_file.namelist()
+    d = names[-1].split('_')[-4:]
+    height = 1.2  # estimated from figure, as the paper does not say
+    spos = np.empty((len(names), 3))
+    rpos = np.empty((8, 3))
     spacing = float(d[1][0])/100 * np.arange(4) + 0.04
     rpos[:, 0] = np.concatenate([-spacing[::-1], spacing])
     rpos[:, 1] = np.zeros(8)
     rpos[:, 2] = height
-    ir = ir.T
     # The IRs contain an additional dead time not explained by the source-receiver distance.
     # It is probably due to dead time in the measurement setup.
     # We compensate this by offsetting the IRs such that the offset plus the minimal geometric dead time equals 750.
     # The removal of 750 samples is done in several other papers using this dataset.
     offset = 629
-    T60 = np.ceil(float(d[0][:-2])*48000).astype(int)
-    noise = ir[-T60:]
-    ir = ir[offset:T60+offset]
-    np.savez(outfile, ir=ir, noise=noise, fs=48000, spos=spos, rpos=rpos)
-    return outfile
-
-
-def fetch_data(dataset, scenario):
+    T60 = int(np.ceil(float(d[0][:-2])*48000))
+    # the windows of the IRs are written straight to the processed files in (time, receiver, source) layout
+    shape = (T60, 8, len(names))
+    ir = np.lib.format.open_memmap(outdir / 'ir.npy', mode='w+', dtype=dtype, shape=shape, fortran_order=True)
+    noise = np.lib.format.open_memmap(outdir / 'noise.npy', mode='w+', dtype=dtype, shape=shape, fortran_order=True)
+
+    def decode(i, n):
+        d = n.split('_')[-4:]
+        r, phi = float(d[2][0]), 2*np.pi*float(d[3][:3])/360
+        spos[i] = r*np.sin(phi), r*np.cos(phi), height
+        # ZipFile objects must not be shared between threads
+        with ZipFile(infile, "r") as zip_file:
+            h = loadmat(BytesIO(zip_file.read(n)))['impulse_response']
+        ir[..., i] = h[offset:T60+offset]
+        noise[..., i] = h[-T60:]
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(decode, range(len(names)), names))
+    ir.flush()
+    noise.flush()
+    save(outdir, fs=48000, spos=spos, rpos=rpos)
+    return outdir
+
+
+def save(outdir, **arrays):
+    # store each array as a raw .npy file, so that it can be memory mapped
+    for key, arr in arrays.items():
+        np.save(outdir / f'{key}.npy', arr)
+
+
+def load(path):
+    # the time axis stays contiguous, as in the processed files
+    return {f.stem: np.load(f, mmap_mode='r' if f.stem in mmap_keys else None) for f in Path(path).glob('*.npy')}
+
+
+def fetch_path(dataset, scenario):
+    # directory of the processed data, which is downloaded and processed if necessary
     if dataset.upper() == 'MIRACLE':
-        path = miracle.fetch(scenario[:2] + '.h5', progressbar=True, processor=process_miracle)
+        return miracle.fetch(scenario[:2] + '.h5', progressbar=True, processor=process_miracle)
     elif dataset.upper() == 'MIRD':
-        path = mird.fetch(scenario[:-1].lower() + '_' + scenario[-1] + '.zip', progressbar=True, processor=process_mird)
-
-    data = dict(np.load(path))
-
-    if dataset == 'MIRACLE' and scenario.endswith('-C1'):
-        print('Subselecting a coarser grid (a quarter of the source locations).')
-        idx = np.arange(4096).reshape(64, 64)[::2, ::2].reshape(1024)
-        data['ir'] = data['ir'][..., idx]
-        data['spos'] = data['spos'][idx]
-
+        return mird.fetch(scenario[:-1].lower() + '_' + scenario[-1] + '.zip', progressbar=True, processor=process_mird)
+
+
+def fetch_shape(dataset, scenario):
+    # shape of the IRs of a scenario, only the header of the processed file is read
+    T, p, m = np.load(Path(fetch_path(dataset, scenario)) / 'ir.npy', mmap_mode='r').shape
+    if dataset.upper() == 'MIRACLE' and '-' in scenario:
+        m = miracle_grids[scenario.split('-')[1]].size
+    return T, p, m
+
+
+def fetch_data(dataset, scenario, sources=None, receivers=None, window=None):
+    # sources, receivers and window select a hyperslab of the IRs, only the selected channels are read
+    data = load(fetch_path(dataset, scenario))
+
+    if dataset.upper() == 'MIRACLE' and '-' in scenario:
+        grid = miracle_grids[scenario.split('-')[1]]
+        print(f'Subselecting a coarser grid ({grid.size} of {data["spos"].shape[0]} source locations).')
+        sources = grid if sources is None else grid[sources]
+
+    return select(data, sources=sources, receivers=receivers, window=window)
+
+
+def select(data, sources=None, receivers=None, window=None):
+    # the processed IRs are time contiguous, so slicing the time first and the channels last
+    # only reads the selected parts of the memory mapped files
+    data = dict(data)
+    for key in ('ir', 'noise'):
+        if key in data:
+            if window is not None:
+                data[key] = data[key][window]
+            if receivers is not None:
+                data[key] = data[key][:, receivers]
+            if sources is not None:
+                data[key] = data[key][..., sources]
+    if receivers is not None:
+        data['rpos'] = data['rpos'][receivers]
+    if sources is not None:
+        data['spos'] = data['spos'][sources]
     return data
@@ -1,27 +1,45 @@
 #!/usr/bin/env python3
 
+import json
+import os
 import numpy as np
+import scipy.linalg as spla
+
+from pathlib import Path
+from time import perf_counter
 
 from era_dts.fastoperators import NumbaHankelOperator
+from era_dts.perf import phase, record
 
 from pymor.reductors.era import RandomizedERAReductor as pyMORRandomizedERAReductor
 from pymor.algorithms.rand_la import RandomizedRangeFinder
+from pymor.models.iosys import LTIModel
+from pymor.operators.numpy import NumpyMatrixOperator
+from pymor.tools.random import get_rng
 
 
 class RandomizedERAReductor(pyMORRandomizedERAReductor):
     def __init__(self, data, sampling_time, force_stability=True, feedthrough=None, allow_transpose=True, rrf_opts={},
-                 num_left=None, num_right=None):
+                 num_left=None, num_right=None, accumulation='frequency', spectrum_cache=None, max_memory=None,
+                 processes=None):
         super(pyMORRandomizedERAReductor, self).__init__(data, sampling_time, force_stability=force_stability, feedthrough=feedthrough)
         self.__auto_init(locals())
         #data = data.copy()
+        self._W, self._V, self.projection_errors = None, None, (0., 0.)
         if num_left is not None or num_right is not None:
             self.logger.info('Computing the projected Markov parameters ...')
-            data = self._project_markov_parameters(num_left, num_right)
+            with phase('projection'):
+                data = self._project_markov_parameters(num_left, num_right)
         if self.force_stability:
-            data = np.concatenate([data, np.zeros_like(data)[1:]], axis=0)
-        s = (data.shape[0] + 1) // 2
+            # Hankel operator of the data padded with len(data)-1 zeros, the padding is a broadcast array that
+            # takes no memory, its first block r[0] = c[-1] is never used
+            c, r = data, np.broadcast_to(np.zeros((), dtype=data.dtype), data.shape)
+        else:
+            s = (data.shape[0] + 1) // 2
+            c, r = data[:s], data[s-1:]
         self._transpose = (data.shape[1] < data.shape[2]) if allow_transpose else False
-        self._H = NumbaHankelOperator(data[:s], r=data[s-1:])
+        self._H = NumbaHankelOperator(c, r=r, accumulation=accumulation, spectrum_cache=spectrum_cache,
+                                      max_memory=max_memory, processes=processes)
         if self._transpose:
             self.logger.info('Using transposed formulation.')
             self._H = self._H.H
@@ -40,6 +58,150 @@ class RandomizedERAReductor(pyMORRandomizedERAReductor):
         # faster way of computing the random samples for Hankel matrices
         self._rrf.logger.info(f'Taking {num} samples ...')
         dtype = self.data.dtype
-        V = np.zeros((self._H._circulant.source.dim, num), dtype=dtype)
-        V[:self._H.source.dim] = self._H.source.random(num, distribution='normal').to_numpy().T
-        return self._H.range.make_array(self._H._circulant._circular_matvec(V)[:, :self._H.range.dim])
+        circulant = self._H._circulant
+        Y = np.zeros((num, self._H.range.dim), dtype=dtype)
+        # draw and apply the samples chunk by chunk to bound the size of the zero padded samples
+        tic = perf_counter()
+        with phase('sampling'):
+            for cols in circulant._column_chunks(num, dtype):
+                V = np.zeros((circulant.source.dim, cols.stop - cols.start), dtype=dtype)
+                V[:self._H.source.dim] = self._H.source.random(cols.stop - cols.start, distribution='normal').to_numpy().T
+                circulant._circular_matvec(V, out=Y[cols])
+        # cost of each round of the range finder
+        record('sampling', samples=num, basis_size=len(self._rrf.Q[0]), time=perf_counter() - tic)
+        return self._H.range.make_array(Y)
+
+    def sweep(self, tols=None, orders=None, block_size=None, checkpoint=None, resume=False):
+        # the basis of the range finder only grows, so it is extended once through all tolerances or orders and the
+        # nested reduced models are truncations of a single projected SVD of the final basis
+        assert (tols is None) != (orders is None)
+        h2 = self._weighted_h2_norm()
+        targets = sorted(tols, reverse=True) if tols is not None else sorted(orders)
+        done, sizes, err_est = [], [], []
+        if resume and checkpoint is not None and os.path.exists(checkpoint):
+            done, sizes, err_est = self.load_checkpoint(checkpoint)
+            assert np.array_equal(done, targets[:len(done)]), 'Checkpoint does not match the tolerances or orders.'
+        for t in targets[len(done):]:
+            with phase('range_finder'):
+                Q = self._rrf.find_range(tol=t*h2) if tols is not None else self._rrf.find_range(basis_size=t)
+            done.append(t)
+            sizes.append(len(Q))
+            err_est.append(self._rrf.estimate_error()/h2)
+            if block_size is not None:
+                self._rrf.block_size = block_size(len(Q))
+            # the basis sizes and estimates are checkpointed with the range finder, so only the SVD is repeated
+            if checkpoint is not None:
+                with phase('io'):
+                    self.save_checkpoint(checkpoint, done, sizes, err_est)
+
+        Q = self._rrf.Q[-1][:sizes[-1]]
+        self.logger.info(f'Computing projected SVD of rank {len(Q)} ...')
+        with phase('svd'):
+            Ub, sv, Vh = spla.svd(self._H.apply_adjoint(Q).to_numpy().conj(), full_matrices=False,
+                                  lapack_driver='gesvd')
+            U = Q.to_numpy().T @ Ub
+        if self._transpose:
+            U, Vh = Vh.conj().T, U.conj().T
+        for r, est in zip(sizes, err_est):
+            # Kung's error bound of the model, i.e. twice its last Hankel singular value
+            yield self._construct_rom(sv[:r], U[:, :r], Vh[:r]), sv[:r], est, 2*sv[r-1]
+
+    def save_checkpoint(self, path, done, sizes, err_est):
+        # state of the range finder and the finished tolerances or orders, stored in the dtype of the data
+        path = Path(path)
+        self.logger.info(f'Writing checkpoint to {path} ...')
+        dtype = self.data.dtype
+        rrf = self._rrf
+        arrays = {f'Q_{i}': q.to_numpy().astype(dtype, copy=False) for i, q in enumerate(rrf.Q)}
+        arrays |= {f'R_{i}': r.astype(dtype, copy=False) for i, r in enumerate(rrf.R)}
+        tmpfile = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, Omega=rrf.Omega.to_numpy().astype(dtype, copy=False), block_size=rrf.block_size,
+                     estimator_last_basis_size=rrf.estimator_last_basis_size,
+                     last_estimated_error=getattr(rrf, 'last_estimated_error', np.inf),
+                     rng_state=json.dumps(get_rng().bit_generator.state),
+                     done=np.array(done), sizes=np.array(sizes), err_est=np.array(err_est), **arrays)
+        os.replace(tmpfile, path)
+
+    def load_checkpoint(self, path):
+        self.logger.info(f'Resuming from checkpoint {path} ...')
+        rrf = self._rrf
+        with np.load(path) as data:
+            rrf.Q = [q.space.make_array(data[f'Q_{i}']) for i, q in enumerate(rrf.Q)]
+            rrf.R = [data[f'R_{i}'] for i in range(len(rrf.R))]
+            rrf.Omega = rrf.Omega.space.make_array(data['Omega'])
+            rrf.block_size = int(data['block_size'])
+            rrf.estimator_last_basis_size = int(data['estimator_last_basis_size'])
+            rrf.last_estimated_error = float(data['last_estimated_error'])
+            get_rng().bit_generator.state = json.loads(str(data['rng_state']))
+            return list(data['done']), list(data['sizes']), list(data['err_est'])
+
+    def _project_markov_parameters(self, num_left, num_right, oversampling=10, block=1000):
+        # randomized tangential projection, which streams the (memory mapped) data in blocks of time samples
+        # and computes in its dtype, the projections are found from sketches of the horizontal and vertical
+        # unfoldings of the Markov parameters and the eigendecompositions of their small Gramians
+        T, p, m = self.data.shape
+        dtype = self.data.dtype
+        rng = get_rng()
+        left = num_left is not None and num_left < p
+        right = num_right is not None and num_right < m
+        kl, kr = min(p, (num_left or 0) + oversampling), min(m, (num_right or 0) + oversampling)
+
+        Yl, Yr = np.zeros((p, kl), dtype=dtype), np.zeros((m, kr), dtype=dtype)
+        for t in range(0, T, block):
+            h = np.asarray(self.data[t:t+block])
+            if left:
+                Yl += np.tensordot(h, rng.standard_normal((len(h), m, kl), dtype=dtype), axes=([0, 2], [0, 1]))
+            if right:
+                Yr += np.tensordot(h, rng.standard_normal((len(h), p, kr), dtype=dtype), axes=([0, 1], [0, 1]))
+        Ql = spla.qr(Yl, mode='economic')[0] if left else None
+        Qr = spla.qr(Yr, mode='economic')[0] if right else None
+
+        Gl, Gr, norm = np.zeros((kl, kl), dtype=dtype), np.zeros((kr, kr), dtype=dtype), 0.
+        for t in range(0, T, block):
+            h = np.asarray(self.data[t:t+block])
+            norm += np.linalg.norm(h)**2
+            if left:
+                B = np.tensordot(Ql, h, axes=([0], [1]))
+                Gl += np.tensordot(B, B, axes=([1, 2], [1, 2]))
+            if right:
+                B = np.tensordot(h, Qr, axes=([2], [0]))
+                Gr += np.tensordot(B, B, axes=([0, 1], [0, 1]))
+
+        errors = [0., 0.]
+        if left:
+            ev, U = spla.eigh(Gl)
+            self._W = Ql @ U[:, ::-1][:, :num_left]
+            errors[0] = np.sqrt(max(0, 1 - np.sum(ev[::-1][:num_left])/norm))
+        if right:
+            ev, U = spla.eigh(Gr)
+            self._V = Qr @ U[:, ::-1][:, :num_right]
+            errors[1] = np.sqrt(max(0, 1 - np.sum(ev[::-1][:num_right])/norm))
+        self.projection_errors = tuple(errors)
+        self.logger.info(f'Relative projection errors: {errors[0]:.2e} (left), {errors[1]:.2e} (right)')
+
+        data = np.empty((T, num_left if left else p, num_right if right else m), dtype=dtype)
+        for t in range(0, T, block):
+            h = np.asarray(self.data[t:t+block])
+            h = h if self._W is None else self._W.T @ h
+            data[t:t+block] = h if self._V is None else h @ self._V
+        return data
+
+    @phase('realization')
+    def _construct_rom(self, sv, U, Vh):
+        # realization from the shift invariance of the observability matrix O, R is the reachability matrix
+        # projected inputs and outputs are lifted to the full dimensions
+        self.logger.info(f'Constructing reduced realization of order {len(sv)} ...')
+        p = self.data.shape[1] if self._W is None else self._W.shape[1]
+        m = self.data.shape[2] if self._V is None else self._V.shape[1]
+        sqsv = np.sqrt(sv)
+        O, R = U * sqsv, Vh * sqsv[:, np.newaxis]
+        if self.force_stability:
+            A = spla.lstsq(O, np.concatenate([O[p:], np.zeros((p, len(sv)), dtype=O.dtype)]))[0]
+        else:
+            A = spla.lstsq(O[:-p], O[p:])[0]
+        B, C = R[:, :m], O[:p]
+        B = B if self._V is None else B @ self._V.T
+        C = C if self._W is None else self._W @ C
+        return LTIModel(NumpyMatrixOperator(A), NumpyMatrixOperator(B), NumpyMatrixOperator(C), D=self.feedthrough,
+                        sampling_time=self.sampling_time)
@@ -1,76 +1,381 @@
 #!/usr/bin/env python3
 
+import atexit
+import hashlib
+import multiprocessing as mp
+import os
+import weakref
 import numba as nb
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
 from scipy.sparse.linalg import LinearOperator
 from scipy.fft import fft, ifft, rfft, irfft
 
+from era_dts.perf import count, phase
+
 from pymor.operators.numpy import NumpyCirculantOperator, NumpyHankelOperator
+from pymor.vectorarrays.numpy import NumpyVectorSpace
+
+
+# worker pools of the shared memory backend, one per number of processes
+_pools = {}
+# shared memory segments attached by a worker process
+_attached = {}
 
 
 class NumbaCirculantOperator(NumpyCirculantOperator):
+    def __init__(self, c, accumulation='frequency', spectrum_cache=None, max_memory=None, processes=None, blocks=None,
+                 name=None):
+        # blocks: optional pairs (offset, a), the circulant vector is then the sum of the arrays a written cyclically
+        # from the given offsets, and c only provides its shape and dtype, e.g. as a broadcast array
+        assert accumulation in ('frequency', 'time')
+        assert processes is None or processes > 0
+        assert blocks is None or all(a.shape[1:] == c.shape[1:] and len(a) <= len(c) for _, a in blocks)
+        super().__init__(c, name=name)
+        self.__auto_init(locals())
+        self._shm, self._spectra = {}, {}
+        weakref.finalize(self, _unlink, self._shm, self._spectra)
+
+    def _spectrum(self, full=False):
+        # computed once and kept as is, pymor's cache would copy the spectrum on every lookup
+        if full not in self._spectra:
+            self._spectra[full] = self._compute_spectrum(full)
+        return self._spectra[full]
+
+    def _empty_spectrum(self, full, shape, dtype):
+        # with processes, the spectrum is only kept in shared memory, where the workers attach to it
+        if self.processes is None:
+            return np.empty(shape, dtype=dtype)
+        return self._shared(('spectrum', full), shape, dtype)[0]
+
+    def _compute_spectrum(self, full):
+        # spectrum of the circulant vector in the (m, p, n) layout of the kernels
+        n = self._arr.shape[0]
+        if full and np.isrealobj(self._arr):
+            # complete the half spectrum with its conjugate symmetric part
+            C = self._spectrum()
+            nf = C.shape[-1]
+            out = self._empty_spectrum(full, (*C.shape[:-1], n), C.dtype)
+            out[..., :nf] = C
+            np.conj(C[..., n - nf:0:-1], out=out[..., nf:])
+            return out
+
+        if self.spectrum_cache is not None:
+            blocks = [(0, self._arr)] if self.blocks is None else self.blocks
+            key = hashlib.blake2b(repr((self._arr.shape, self._arr.dtype.str, [o for o, _ in blocks])).encode(),
+                                  digest_size=20)
+            for _, a in blocks:
+                # hash in chunks of time steps to avoid a contiguous copy of the whole array
+                for i in range(0, len(a), 1000):
+                    key.update(np.ascontiguousarray(a[i:i+1000]))
+            path = Path(self.spectrum_cache) / f'{key.hexdigest()}.npy'
+            if path.exists():
+                # the spectrum is memory mapped, its pages are only read when needed
+                self.logger.info(f'Loading cached spectrum from {path} ...')
+                C = np.asarray(np.load(path, mmap_mode='c'))
+                if self.processes is None:
+                    return C
+                out = self._empty_spectrum(full, C.shape, C.dtype)
+                out[:] = C
+                return out
+
+        self.logger.info('Computing spectrum of the circulant vector ...')
+        with phase('spectrum'):
+            nf = n // 2 + 1 if np.isrealobj(self._arr) else n
+            dtype = np.result_type(self._arr.dtype, np.complex64)
+            C = self._empty_spectrum(full, (*self._arr.shape[:0:-1], nf), dtype)
+            if self.blocks is None:
+                C[:] = rfft(self._arr.T, axis=-1) if np.isrealobj(self._arr) else fft(self._arr.T, axis=-1)
+            else:
+                self._blocks_spectrum(out=C)
+
+        if self.spectrum_cache is not None:
+            self.logger.info(f'Writing spectrum to {path} ...')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmpfile, 'wb') as f:
+                np.save(f, C)
+            os.replace(tmpfile, path)
+        return C
+
+    def _blocks_spectrum(self, out):
+        # the FFTs pad the blocks with zeros implicitly, their cyclic offsets are applied as phase shifts
+        n = self._arr.shape[0]
+        out[:] = 0
+        for offset, a in self.blocks:
+            if _is_zero(a):
+                continue
+            shift = np.exp(-2j * np.pi * offset / n * np.arange(out.shape[-1])).astype(out.dtype)
+            # one input channel at a time, so that the zero padded copies of all channels are never formed at once
+            for j in range(a.shape[2]):
+                A = rfft(a[:, :, j].T, n=n, axis=-1) if np.isrealobj(self._arr) else fft(a[:, :, j].T, n=n, axis=-1)
+                if offset:
+                    A *= shift
+                out[j] += A
+        return out
+
     @staticmethod
-    @nb.njit(
-        [
-            nb.float32[::1, :](nb.int64, nb.int64, nb.int64, nb.int64, nb.float32[:, ::1], nb.float32[:, ::1], nb.complex64[:, :, ::1]),
-            nb.float64[::1, :](nb.int64, nb.int64, nb.int64, nb.int64, nb.float64[:, ::1], nb.float64[:, ::1], nb.complex128[:, :, ::1])
-        ],
-        parallel=True,
-        fastmath=True
-    )
+    # the kernels are compiled lazily, only for the dtypes in use, and cached on disk across runs
+    @nb.njit(parallel=True, fastmath=True, cache=True)
     def _real_ops(m, p, n, d, vec, y, C):
         dim = d // p
+        k = vec.shape[1]
         for j in range(m):
             x = vec[j::m]
             X = rfft(x, axis=0)
             for i in nb.prange(p):
-                Y = X*C[j, i].reshape(-1, 1)
+                # C is indexed elementwise, since the workers of the shared memory backend pass strided views
+                Y = np.empty_like(X)
+                for f in range(X.shape[0]):
+                    c = C[j, i, f]
+                    for l in range(k):
+                        Y[f, l] = c*X[f, l]
                 # setting n=n below is necessary to allow uneven lengths but considerably slower
                 # Hankel operator will always pad to even length to avoid that
                 y[i::p] += irfft(Y, n=n, axis=0)[:dim]
         return y.T
 
     @staticmethod
+    @nb.njit(parallel=True, fastmath=True, cache=True)
+    def _real_ops_freq(m, p, n, d, vec, y, C):
+        dim = d // p
+        k, nf = vec.shape[1], C.shape[2]
+        X = np.empty((m, nf, k), dtype=C.dtype)
+        for j in nb.prange(m):
+            X[j] = rfft(vec[j::m], axis=0)
+        for i in nb.prange(p):
+            # accumulate all inputs in the frequency domain, so only one irfft per output is needed
+            Y = np.zeros((nf, k), dtype=C.dtype)
+            for j in range(m):
+                for f in range(nf):
+                    c = C[j, i, f]
+                    for l in range(k):
+                        Y[f, l] += c*X[j, f, l]
+            y[i::p] = irfft(Y, n=n, axis=0)[:dim]
+        return y.T
+
+    @staticmethod
+    @nb.njit(parallel=True, fastmath=True, cache=True)
     def _complex_ops(m, p, n, d, vec, y, C):
-        for j in range(m):
-            x = vec[j::m]
-            X = fft(x, axis=0)
-            for i in range(p):
-                Y = X*C[:, i, j].reshape(-1, 1)
-                Y = ifft(Y, axis=0, overwrite_x=True)
-                y[i::p] += Y[:d // p]
+        dim = d // p
+        k = vec.shape[1]
+        X = np.empty((m, n, k), dtype=y.dtype)
+        for j in nb.prange(m):
+            X[j] = fft(vec[j::m], axis=0)
+        for i in nb.prange(p):
+            Y = np.zeros((n, k), dtype=y.dtype)
+            for j in range(m):
+                for f in range(n):
+                    c = C[j, i, f]
+                    for l in range(k):
+                        Y[f, l] += c*X[j, f, l]
+            y[i::p] = ifft(Y, axis=0)[:dim]
         return y.T
 
-    def _circular_matvec(self, vec):
+    def _column_chunks(self, k, dtype):
+        # split k right-hand sides into chunks whose FFT workspace fits into max_memory bytes
+        if self.max_memory is None:
+            size = max(k, 1)
+        else:
+            n, p, m = self._arr.shape
+            isreal = np.isrealobj(self._arr) and not np.issubdtype(dtype, np.complexfloating)
+            nf = n // 2 + 1 if isreal else n
+            itemsize = np.dtype(dtype).itemsize
+            citemsize = itemsize * 2 if isreal else itemsize
+            # input, spectra of all inputs and output, as well as one spectrum and inverse transform per thread
+            column = itemsize*n*(m + p) + citemsize*nf*m + nb.get_num_threads()*(citemsize*nf + itemsize*n)
+            size = max(1, int(self.max_memory // column))
+        return [slice(i, min(i + size, k)) for i in range(0, k, size)]
+
+    def _circular_matvec(self, vec, out=None):
         n, p, m = self._arr.shape
-        s, k = vec.shape
-        d = self.range.dim
+        k = vec.shape[1]
 
         # use real arithmetic if possible
         isreal = np.isrealobj(self._arr) and np.isrealobj(vec)
         ismixed = np.isrealobj(self._arr) and np.iscomplexobj(vec)
 
-        C = self._circulant()
-        if ismixed:
-            l =  s // m - C.shape[0] + 1
-            C = np.concatenate([C, C[1:l].conj()[::-1]])
-        C = np.ascontiguousarray(C.T)
-        y = np.zeros((self.range.dim, k), dtype=np.promote_types(self._arr.dtype, vec.dtype))
-        return self._real_ops(m, p, n, d, vec, y, C) if isreal else self._complex_ops(m, p, n, d, vec, y, C)
+        dtype = np.promote_types(self._arr.dtype, vec.dtype)
+        C = self._spectrum(full=ismixed)
+        # the kernels are compiled for matching single or double precision only, the right-hand sides are cast to
+        # the precision of the spectrum, which is never copied, e.g. double precision vectors for single precision data
+        kdtype = np.finfo(C.dtype).dtype if isreal else C.dtype
+        if isreal:
+            ops = '_real_ops_freq' if self.accumulation == 'frequency' else '_real_ops'
+        else:
+            ops = '_complex_ops'
+        # only the leading rows of each output channel that fit into out are computed
+        y = np.zeros((k, self.range.dim), dtype=dtype) if out is None else out
+        assert y.shape[0] == k and y.shape[1] % p == 0 and y.dtype == dtype and y.flags.c_contiguous
+        count('matvecs', k)
+        count('ffts', m*k + (m*p*k if ops == '_real_ops' else p*k))
+        for cols in self._column_chunks(k, kdtype):
+            x = np.ascontiguousarray(vec[:, cols], dtype=kdtype)
+            yk = y[cols] if kdtype == dtype else np.zeros((cols.stop - cols.start, y.shape[1]), dtype=kdtype)
+            if self.processes is None:
+                getattr(self, ops)(m, p, n, y.shape[1], x, yk.T, C)
+            else:
+                self._shared_ops(ops, x, yk, ismixed)
+            if kdtype != dtype:
+                y[cols] = yk
+        return y
+
+    def _shared_ops(self, ops, vec, y, full):
+        # partition the input/output channel pairs across worker processes, which attach to the spectrum,
+        # the right-hand sides and one partial output per group of inputs in shared memory
+        n, p, m = self._arr.shape
+        k, d = y.shape
+        go = min(self.processes, p)
+        gi = min(max(1, self.processes // go), m)
+        # the spectrum was computed into its segment
+        C = self._spectrum(full)
+        C_spec = (self._shm[('spectrum', full)].name, C.shape, C.dtype.str)
+        V, V_spec = self._shared('vec', vec.shape, vec.dtype)
+        V[:] = vec
+        Y, Y_spec = self._shared('y', (gi, k, d), y.dtype)
+
+        if self.processes not in _pools:
+            threads = max(1, nb.config.NUMBA_NUM_THREADS // self.processes)
+            _pools[self.processes] = ProcessPoolExecutor(self.processes, mp_context=mp.get_context('spawn'),
+                                                         initializer=nb.set_num_threads, initargs=(threads,))
+        futures = [_pools[self.processes].submit(_apply_shared, ops, m, p, n, d, a, (J[0], J[-1]+1), (I[0], I[-1]+1),
+                                                   V_spec, C_spec, Y_spec)
+                   for a, J in enumerate(np.array_split(np.arange(m), gi))
+                   for I in np.array_split(np.arange(p), go)]
+        for future in futures:
+            future.result()
+        # reduce the partial outputs of the input groups in place
+        np.sum(Y, axis=0, out=y)
+
+    def _shared(self, key, shape, dtype):
+        # view of a shared memory segment, which is only reallocated if it is too small
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        if key not in self._shm or self._shm[key].size < nbytes:
+            if key in self._shm:
+                self._shm[key].close()
+                self._shm[key].unlink()
+            self._shm[key] = SharedMemory(create=True, size=nbytes)
+        shm = self._shm[key]
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf), (shm.name, tuple(shape), np.dtype(dtype).str)
+
+
+def _unlink(segments, views):
+    # the views into the segments, i.e. the spectra, are released first, a segment cannot be closed while exported
+    views.clear()
+    for shm in segments.values():
+        shm.close()
+        shm.unlink()
+    segments.clear()
+
+
+@atexit.register
+def _shutdown_pools():
+    # the worker processes would otherwise keep running and stay attached to the segments until exit
+    for pool in _pools.values():
+        pool.shutdown()
+    _pools.clear()
+
+
+def _attach(spec):
+    # the spawned workers share the resource tracker of the parent process, which owns and unlinks the segments
+    name, shape, dtype = spec
+    if name not in _attached:
+        _attached[name] = SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+
+
+def _detach(names):
+    # segments that are not used by the current call are detached, e.g. after the parent reallocated them
+    for name in [name for name in _attached if name not in names]:
+        _attached.pop(name).close()
+
+
+def _apply_shared(ops, m, p, n, d, a, inputs, outputs, vec_spec, C_spec, y_spec):
+    # apply the kernel to the input channels j0:j1 and the output channels i0:i1 of a circulant operator
+    _detach({vec_spec[0], C_spec[0], y_spec[0]})
+    vec, C, Y = _attach(vec_spec), _attach(C_spec), _attach(y_spec)
+    (j0, j1), (i0, i1) = inputs, outputs
+    k, dim = vec.shape[1], d // p
+    # the inputs are interleaved in the rows of vec, this is a view if all inputs are selected
+    x = np.ascontiguousarray(vec.reshape(n, m, k)[:, j0:j1].reshape(n*(j1-j0), k))
+    y = np.zeros((dim*(i1-i0), k), dtype=Y.dtype)
+    # the kernels read the spectra of the selected channels through a strided view
+    getattr(NumbaCirculantOperator, ops)(j1-j0, i1-i0, n, dim*(i1-i0), x, y, C[j0:j1, i0:i1])
+    Y[a].reshape(k, dim, p)[:, :, i0:i1] = y.T.reshape(k, dim, i1-i0)
+
+
+def _is_zero(a):
+    # broadcast zeros, e.g. the implicit zero padding of force_stability, are recognized without reading them
+    return a.size == 0 or (not any(a.strides) and not a.flat[0])
+
+
+def _adjoint_blocks(a):
+    # conjugate transposed blocks as a view, real arrays are not copied by conj
+    return (a.conj() if np.iscomplexobj(a) else a).transpose(0, 2, 1)
 
 
 class NumbaHankelOperator(NumpyHankelOperator):
-    def __init__(self, c, r=None, name=None):
-        super().__init__(c, r=r, name=name)
+    def __init__(self, c, r=None, accumulation='frequency', spectrum_cache=None, max_memory=None, processes=None,
+                 name=None):
+        # pymor's __init__ is not called, since it forms a rolled and zero padded copy of the data
+        assert isinstance(c, np.ndarray)
+        c = c.reshape(-1, 1, 1) if c.ndim == 1 else c
+        if r is None:
+            # zeros as in scipy.linalg.hankel, r[0] = c[-1] is never read
+            r = np.broadcast_to(np.zeros((), dtype=c.dtype), c.shape)
+        else:
+            assert isinstance(r, np.ndarray)
+            r = r.reshape(-1, 1, 1) if r.ndim == 1 else r
+            assert r.ndim == 3 and c.shape[1:] == r.shape[1:]
+            assert _is_zero(r) or np.allclose(r[0], c[-1])
+        assert c.ndim == 3
+        self.__auto_init(locals())
+        self._adjoint = None
         k, l = self.c.shape[0], self.r.shape[0]
         n = k + l - 1
+        p, m = c.shape[1:]
+        self.source = NumpyVectorSpace(l*m)
+        self.range = NumpyVectorSpace(k*p)
         # zero pad to even length if real to avoid slow irfft
         z = int(np.isrealobj(self.c) and np.isrealobj(self.r) and n % 2)
-        h = np.concatenate((self.c, self.r[1:], np.zeros([z, *self.c.shape[1:]], dtype=c.dtype)))
         shift = n // 2 + int(np.ceil((k - l) / 2)) + (n % 2) + z # this works
+        # the rolled and zero padded circulant vector is never formed, c and r only enter its spectrum as blocks
+        # at their rolled offsets, a broadcast r (e.g. the zero padding of force_stability) is not even transformed
+        h = np.broadcast_to(np.zeros((), dtype=np.promote_types(self.c.dtype, self.r.dtype)),
+                            (n + z, *self.c.shape[1:]))
+        blocks = ((shift % (n + z), self.c), ((k + shift) % (n + z), self.r[1:]))
         self._circulant = NumbaCirculantOperator(
-            np.roll(h, shift, axis=0), name=self.name + ' (implicit circulant)')
+            h, accumulation=accumulation, spectrum_cache=spectrum_cache, max_memory=max_memory,
+            processes=processes, blocks=blocks, name=self.name + ' (implicit circulant)')
+
+    def apply(self, U, mu=None):
+        assert U in self.source
+        U = U.to_numpy()
+        n, p, m = self._circulant._arr.shape
+        dtype = np.promote_types(U.dtype, self._circulant._arr.dtype)
+        Y = np.zeros((len(U), self.range.dim), dtype=dtype)
+        # only one chunk of the zero padded right-hand sides is held in memory at a time
+        for cols in self._circulant._column_chunks(len(U), dtype):
+            x = np.zeros((n*m, cols.stop - cols.start), dtype=dtype)
+            for j in range(m):
+                x[:self.source.dim][j::m] = np.flip(U[cols, j::m].T, axis=0)
+            self._circulant._circular_matvec(x, out=Y[cols])
+        return self.range.make_array(Y)
+
+    @property
+    def H(self):
+        # keep the adjoint, so that its spectrum is only computed once
+        if self._adjoint is None:
+            # the adjoint is again a Hankel operator of h = [c, r[1:]], take its c and r as views where possible
+            k, l = len(self.c), len(self.r)
+            c = self.c[:l] if l <= k else np.concatenate([self.c, self.r[1:l-k+1]])
+            r = self.r[l-k:] if l >= k else np.concatenate([self.c[l-1:], self.r[1:]])
+            self._adjoint = self.with_(c=_adjoint_blocks(c), r=_adjoint_blocks(r), name=self.name + '_adjoint')
+            self._adjoint._adjoint = self
+        return self._adjoint
 
     def to_scipy_linear_operator(self):
         def matvec(x):
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import json
+import numba as nb
+import numpy as np
+
+from pathlib import Path
+from scipy.fft import set_workers
+from time import perf_counter
+
+from pymor.models.iosys import LTIModel
+from pymor.operators.numpy import NumpyHankelOperator
+
+from era_dts.era import RandomizedERAReductor
+from era_dts.fastoperators import NumbaHankelOperator
+from era_dts.utils import apply_dead_times, impulse_response_blocks
+
+
+parser = argparse.ArgumentParser(description='Benchmarks of the Hankel operator and the ERA pipeline on synthetic Markov parameters.')
+parser.add_argument('-p', '--outputs', type=int, nargs='+', default=(4,), help='Numbers of outputs.', dest='p')
+parser.add_argument('-m', '--inputs', type=int, nargs='+', default=(8,), help='Numbers of inputs.', dest='m')
+parser.add_argument('-T', '--length', type=int, nargs='+', default=(2000,), help='Numbers of Markov parameters.', dest='T')
+parser.add_argument('-k', '--samples', type=int, nargs='+', default=(10,), help='Numbers of right-hand sides.', dest='k')
+parser.add_argument('-d', '--dtypes', nargs='+', choices=['float32', 'float64'], default=('float32', 'float64'), help='Data types of the Markov parameters.', dest='dtypes')
+parser.add_argument('-a', '--accumulation', nargs='+', choices=['time', 'frequency'], default=('time', 'frequency'), help='Accumulation of the circulant kernels, in the time or in the frequency domain. Defaults to both.', dest='accumulation')
+parser.add_argument('-np', '--processes', type=int, nargs='+', default=(None,), help='Numbers of worker processes of the shared memory backend. Disabled by default.', dest='processes')
+parser.add_argument('-nt', '--threads', type=int, nargs='+', default=(nb.config.NUMBA_NUM_THREADS,), help='Numbers of threads.', dest='threads')
+parser.add_argument('-b', '--benchmarks', nargs='+', default=None, help='Benchmarks to run. Defaults to all.', dest='benchmarks')
+parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of repetitions, the fastest is reported.', dest='repeat')
+parser.add_argument('-s', '--save', type=Path, default=None, help='Store the results as JSON, e.g. as a baseline.', dest='save')
+parser.add_argument('-c', '--compare', type=Path, default=None, help='Compare the results with a stored baseline.', dest='compare')
+parser.add_argument('--check', action='store_true', help='Check the Hankel operator against pymor and a dense reference. Only feasible for small sizes.', dest='check')
+
+
+def markov_parameters(T, p, m, dtype, seed=0):
+    # exponentially decaying random Markov parameters
+    rng = np.random.default_rng(seed)
+    return (rng.normal(size=(T, p, m)) * np.exp(-5*np.arange(T)/T)[:, np.newaxis, np.newaxis]).astype(dtype)
+
+
+def dense_hankel(h):
+    s = (len(h) + 1) // 2
+    T, p, m = h.shape
+    return np.block([[h[i+j] for j in range(T - s + 1)] for i in range(s)])
+
+
+def check(h, accumulation='frequency', processes=None):
+    # compare the Hankel operator with pymor's implementation and a dense reference
+    s = (len(h) + 1) // 2
+    H = NumbaHankelOperator(h[:s], r=h[s-1:], accumulation=accumulation, processes=processes)
+    U = H.source.random(3, distribution='normal')
+    V = H.range.random(3, distribution='normal')
+    rtol = 1e-3 if h.dtype == np.float32 else 1e-10
+    Hd = dense_hankel(h.astype(np.float64))
+    ref = NumpyHankelOperator(h[:s], r=h[s-1:])
+    errors = {}
+    for name, y, y_ref, y_dense in [
+            ('apply', H.apply(U).to_numpy(), ref.apply(U).to_numpy(), U.to_numpy() @ Hd.T),
+            ('apply_adjoint', H.apply_adjoint(V).to_numpy(), ref.apply_adjoint(V).to_numpy(), V.to_numpy() @ Hd)]:
+        errors[name] = max(np.linalg.norm(y - y_ref), np.linalg.norm(y - y_dense)) / np.linalg.norm(y_dense)
+        assert errors[name] < rtol, f'{name} deviates from the reference by {errors[name]:.2e}'
+    return errors
+
+
+def bench_apply(h, k, accumulation, processes):
+    s = (len(h) + 1) // 2
+    H = NumbaHankelOperator(h[:s], r=h[s-1:], accumulation=accumulation, processes=processes)
+    U = H.source.from_numpy(np.random.default_rng(0).normal(size=(k, H.source.dim)).astype(h.dtype))
+    return lambda: H.apply(U), 2*H.range.dim*H.source.dim*k
+
+
+def bench_apply_adjoint(h, k, accumulation, processes):
+    s = (len(h) + 1) // 2
+    H = NumbaHankelOperator(h[:s], r=h[s-1:], accumulation=accumulation, processes=processes)
+    V = H.range.from_numpy(np.random.default_rng(0).normal(size=(k, H.range.dim)).astype(h.dtype))
+    return lambda: H.apply_adjoint(V), 2*H.range.dim*H.source.dim*k
+
+
+def bench_draw_samples(h, k, accumulation, processes):
+    era = RandomizedERAReductor(h[1:], 1., feedthrough=h[0], force_stability=False, accumulation=accumulation,
+                                processes=processes)
+    return lambda: era._draw_samples(k), 2*era._H.range.dim*era._H.source.dim*k
+
+
+def bench_apply_dead_times(h, k, accumulation, processes):
+    d = np.random.default_rng(0).integers(-len(h)//10, len(h)//10, size=h.shape[1:])
+    out = np.empty_like(h, order='C')
+    return lambda: apply_dead_times(h, d, out=out), h.size
+
+
+def bench_impulse_response(h, k, accumulation, processes):
+    # random stable system of order k*10
+    T, p, m = h.shape
+    n = 10*k
+    rng = np.random.default_rng(0)
+    Q = np.linalg.qr(rng.normal(size=(n, n)))[0]
+    sys = LTIModel.from_matrices(0.99*Q, rng.normal(size=(n, m)), rng.normal(size=(p, n)), sampling_time=1)
+    return lambda: sum(1 for _ in impulse_response_blocks(sys, T, dtype=h.dtype)), 2*n*p*m*T
+
+
+benchmarks = {
+    'apply': bench_apply,
+    'apply_adjoint': bench_apply_adjoint,
+    'draw_samples': bench_draw_samples,
+    'apply_dead_times': bench_apply_dead_times,
+    'impulse_response': bench_impulse_response,
+}
+# benchmarks of the circulant kernels, which are run for each accumulation and number of processes
+hankel_benchmarks = ('apply', 'apply_adjoint', 'draw_samples')
+
+
+def timeit(func, repeat):
+    # the first call compiles and computes cached spectra
+    func()
+    times = []
+    for _ in range(repeat):
+        tic = perf_counter()
+        func()
+        times.append(perf_counter() - tic)
+    return min(times)
+
+
+def run():
+    args = parser.parse_args()
+    names = args.benchmarks or list(benchmarks)
+    baseline = {} if args.compare is None else {r['case']: r for r in json.loads(args.compare.read_text())}
+    results = []
+    for p, m, T, k, dtype in itertools.product(args.p, args.m, args.T, args.k, args.dtypes):
+        h = markov_parameters(T, p, m, dtype)
+        variants = list(itertools.product(args.accumulation, args.processes))
+        if args.check:
+            for accumulation, processes in variants:
+                errors = check(h, accumulation, processes)
+                print(f'p={p} m={m} T={T} {dtype} {accumulation} processes={processes}: '
+                      + ', '.join(f'{n} rel. error {e:.1e}' for n, e in errors.items()))
+        for name, threads in itertools.product(names, args.threads):
+            for accumulation, processes in variants if name in hankel_benchmarks else [(None, None)]:
+                nb.set_num_threads(threads)
+                with set_workers(threads):
+                    func, flops = benchmarks[name](h, k, accumulation, processes)
+                    time = timeit(func, args.repeat)
+                case = f'{name} p={p} m={m} T={T} k={k} {dtype} threads={threads}'
+                if name in hankel_benchmarks:
+                    case += f' {accumulation} processes={processes}'
+                results.append({'case': case, 'time': time, 'samples_per_s': k/time, 'gflops': flops/time/1e9})
+                line = f'{case:<90} {time*1e3:10.2f} ms {k/time:10.1f} samples/s {flops/time/1e9:8.2f} GFLOP/s'
+                if case in baseline:
+                    line += f' {baseline[case]["time"]/time:6.2f}x vs. baseline'
+                print(line)
+    if args.save is not None:
+        args.save.write_text(json.dumps(results, indent=2))
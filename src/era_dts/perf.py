@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import platform
+import resource
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from importlib.metadata import PackageNotFoundError, version
+
+
+# accumulated wall time, number of calls and memory of each phase, as well as event counters of the current run
+phases = defaultdict(lambda: {'calls': 0, 'time': 0., 'rss_change': 0, 'peak_rss_increase': 0})
+counters = defaultdict(int)
+# records of the individual calls, e.g. of each sampling round of the range finder
+series = defaultdict(list)
+
+
+def rss():
+    # current resident set size in bytes
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return peak_rss()
+
+
+def peak_rss():
+    # ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if platform.system() == 'Darwin' else maxrss * 1024
+
+
+@contextmanager
+def phase(name):
+    # phases may be nested, the time of a phase includes the time of its subphases
+    rss0, peak0, tic = rss(), peak_rss(), time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = phases[name]
+        stats['calls'] += 1
+        stats['time'] += time.perf_counter() - tic
+        stats['rss_change'] += rss() - rss0
+        stats['peak_rss_increase'] = max(stats['peak_rss_increase'], peak_rss() - peak0)
+
+
+def count(name, n=1):
+    counters[name] += n
+
+
+def record(name, **values):
+    series[name].append(values)
+
+
+def reset():
+    phases.clear()
+    counters.clear()
+    series.clear()
+
+
+def _version(pkg):
+    # e.g. when run from a source checkout without installing it
+    try:
+        return version(pkg)
+    except PackageNotFoundError:
+        return None
+
+
+def write(path, **info):
+    # machine readable summary of the run, written atomically so that it can be updated during a run
+    info |= {
+        'machine': platform.node(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'versions': {pkg: _version(pkg) for pkg in ('era_dts', 'numpy', 'scipy', 'numba', 'pymor')},
+    }
+    tmpfile = f'{path}.{os.getpid()}.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump({'info': info, 'peak_rss': peak_rss(), 'phases': phases, 'counters': counters,
+                   'series': series}, f, indent=2)
+    os.replace(tmpfile, path)
@@ -3,40 +3,32 @@
 import numpy as np
 from pathlib import Path
 
-from era_dts.downloader import fetch_data
-from era_dts.dead_time_extraction import split_dead_times
-from era_dts.utils import estimate_dead_times
+from era_dts.results import load_metadata
 
 
 model_dir = Path('models')
 pgfdata_dir = Path('pgfdata')
-pgfdata_dir.mkdir(parents=True, exist_ok=True)
 
 
 def export_txt(dataset, path):
-    scenario, case = path.name.split('-')
+    # the tables only depend on the metadata of the results, the impulse responses are not loaded
+    results = load_metadata(path / 'results.h5')
+    scenario, case = results['scenario'], results['dte']
+    T, p, m = results['shape']
 
-    data = fetch_data(dataset, scenario)
-    ir, fs = data['ir'], data['fs']
-    ir = ir.astype(np.float32)
-    T, p, m = ir.shape
-
-    orders = np.load(path / 'orders.npy')
+    orders = results['orders']
     dofs = (orders+m)*(orders+p)
-    if case in ('LC', 'DTS'):
-        d = estimate_dead_times(data['rpos'], data['spos'], 343, fs, subsample=False)
-        if case == 'LC':
-            dofs += min(m,p)*np.min(d)
-        else:
-            do, di = split_dead_times(d, subsample=True)
-            dofs += (np.sum(do) + np.sum(di)).astype(int)
-    irnorm = (np.load(path / 'err_true.npy')/np.load(path / 'err_relative.npy'))[0]
+    if case == 'LC':
+        dofs += min(m,p)*np.min(results['output_dead_times'])
+    elif case == 'DTS':
+        dofs += (np.sum(results['output_dead_times']) + np.sum(results['input_dead_times'])).astype(int)
+    irnorm = results['irnorm']
     print(scenario, irnorm)
-    err_rel = 20*np.log10(np.load(path / 'err_relative.npy'))
-    kung = np.load(path / 'err_kung.npy')
+    err_rel = 20*np.log10(results['err_relative'])
+    kung = results['err_kung']
     kung_new = 20*np.log10(kung)
     kung_old = 10*np.log10(kung/irnorm)
-    loo = np.load(path / 'err_est.npy')
+    loo = results['err_est']
     loo = 20*np.log10(loo)
 
     np.savetxt(pgfdata_dir / f'{dataset}-{scenario}-{case}.txt',
@@ -46,6 +38,6 @@ def export_txt(dataset, path):
 
 
 def create_txt4pgf():
-    for dataset in model_dir.glob('*'):
-        for path in dataset.glob('*'):
-            export_txt(dataset.name, path)
+    pgfdata_dir.mkdir(parents=True, exist_ok=True)
+    for path in model_dir.glob('*/*/results.h5'):
+        export_txt(path.parent.parent.name, path.parent)
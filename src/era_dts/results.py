@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import h5py as h5
+import numpy as np
+
+
+# metrics of the tolerance sweep, one entry per order
+metric_keys = ('orders', 'err_true', 'err_relative', 'err_est', 'err_kung', 'elapsed')
+# the matrices of the reduced order models are stored in single precision
+dtype = np.float32
+
+
+def create(path, resume=False, **meta):
+    # one store per run, scalar metadata are stored as attributes, arrays like the dead times as datasets
+    f = h5.File(path, 'a' if resume else 'w')
+    for key, value in meta.items():
+        if value is None:
+            # unset options like the number of projection directions cannot be stored as attributes
+            if key in f.attrs:
+                del f.attrs[key]
+        elif isinstance(value, np.ndarray):
+            if key in f:
+                del f[key]
+            f.create_dataset(key, data=value)
+        else:
+            f.attrs[key] = value
+    for key in metric_keys:
+        if key not in f:
+            f.create_dataset(key, shape=(0,), maxshape=(None,), dtype=np.int64 if key == 'orders' else np.float64)
+    f.require_group('roms')
+    return f
+
+
+def append(f, rom, hsv, compression=None, **metrics):
+    # an order that is computed again after resuming replaces its previous entry
+    order = rom.order
+    i = np.flatnonzero(f['orders'][:] == order)
+    i = i[0] if len(i) else len(f['orders'])
+    for key in metric_keys:
+        if i == len(f[key]):
+            f[key].resize((i + 1,))
+        f[key][i] = order if key == 'orders' else metrics[key]
+
+    if str(order) in f['roms']:
+        del f['roms'][str(order)]
+    g = f['roms'].create_group(str(order))
+    g.attrs['sampling_time'] = rom.sampling_time
+    A, B, C, D, _ = rom.to_matrices()
+    for key, value in zip('ABCD', (A, B, C, D)):
+        g.create_dataset(key, data=np.asarray(value, dtype=dtype), compression=compression)
+    g.create_dataset('hsv', data=hsv)
+    # the store stays consistent if the run is interrupted
+    f.flush()
+
+
+def load_metadata(path):
+    # everything but the reduced order models, which are only read on demand
+    with h5.File(path, 'r') as f:
+        return dict(f.attrs) | {key: value[()] for key, value in f.items() if isinstance(value, h5.Dataset)}
+
+
+def load_rom(path, order):
+    from pymor.models.iosys import LTIModel
+
+    with h5.File(path, 'r') as f:
+        g = f['roms'][str(order)]
+        A, B, C, D = (g[key][()] for key in 'ABCD')
+        return LTIModel.from_matrices(A, B, C, D, sampling_time=g.attrs['sampling_time']), g['hsv'][()]
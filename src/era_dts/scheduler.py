@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import multiprocessing as mp
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import redirect_stdout
+from pathlib import Path
+
+
+# thread pools of the BLAS libraries, only respected if set before numpy is imported
+blas_threads = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def parse_job(job):
+    # jobs are specified like the targets of the Makefile, e.g. MIRACLE/A1-C1-DTS
+    dataset, case = job.split('/')
+    scenario, dte = case.rsplit('-', 1)
+    return dataset.upper(), scenario.upper(), dte.upper()
+
+
+def predict_memory(T, p, m, itemsize, max_order=None, power_iterations=2, force_stability=False):
+    # data, dead time corrected copy, implicit circulants and spectra of the Hankel operator and its adjoint
+    data = 6 * T * p * m * itemsize
+    # bases of the range finder and its power iterations, the drawn samples and the factors of the projected SVD,
+    # the vectors live in the range of the (transposed) Hankel operator, whose order is bounded by its rank
+    s = T if force_stability else T // 2
+    order = s * min(p, m) if max_order is None else min(max_order, s * min(p, m))
+    bases = (power_iterations + 3) * s * max(p, m) * order * itemsize
+    return data + bases
+
+
+def run_batch(jobs, num_jobs=1, memory_budget=None, max_order=None, **opts):
+    import numpy as np
+    from era_dts.construct import era_opts, rrf_opts
+    from era_dts.downloader import fetch_shape, dtype
+
+    jobs = [parse_job(job) for job in jobs]
+    threads = max(1, os.cpu_count() // num_jobs)
+    memory_budget = None if memory_budget is None else memory_budget * 2**30
+
+    # fetch each scenario once, so that all methods use the same processed data, only its shape is read here
+    memory = {}
+    for dataset, scenario in dict.fromkeys((dataset, scenario) for dataset, scenario, _ in jobs):
+        T, p, m = fetch_shape(dataset, scenario)
+        memory[dataset, scenario] = predict_memory(T, p, m, np.dtype(dtype).itemsize, max_order=max_order,
+                                                   power_iterations=rrf_opts['power_iterations'],
+                                                   force_stability=era_opts['force_stability'])
+    pending = sorted(jobs, key=lambda job: memory[job[:2]], reverse=True)
+    print(f'Running {len(jobs)} jobs with {num_jobs} processes and {threads} threads each.')
+
+    # every job gets a fresh process, so that the thread settings take effect
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(num_jobs, mp_context=ctx, initializer=_init_worker, initargs=(threads,),
+                             max_tasks_per_child=1) as executor:
+        running = {}
+        while pending or running:
+            # admit the largest pending job that fits into the memory budget, or any job if none is running
+            used = sum(memory[job[:2]] for job in running.values())
+            admissible = [job for job in pending
+                          if memory_budget is None or not running or used + memory[job[:2]] <= memory_budget]
+            if admissible and len(running) < num_jobs:
+                job = admissible[0]
+                pending.remove(job)
+                print(f'Starting {"/".join(job[:2])}-{job[2]} (predicted memory {memory[job[:2]]/2**30:.1f} GiB).')
+                running[executor.submit(_run_job, *job, threads=threads, **opts)] = job
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                dataset, scenario, dte = running.pop(future)
+                error = future.exception()
+                print(f'Finished {dataset}/{scenario}-{dte}' + ('.' if error is None else f' with error: {error!r}'))
+
+
+def _init_worker(threads):
+    for var in blas_threads:
+        os.environ[var] = str(threads)
+    os.environ['NUMBA_NUM_THREADS'] = str(threads)
+
+
+def _run_job(dataset, scenario, dte, threads, model_dir, **opts):
+    from era_dts.construct import construct
+    from pymor.tools.random import new_rng
+
+    log = Path(model_dir) / dataset / f'{scenario}-{dte}' / 'log.txt'
+    log.parent.mkdir(parents=True, exist_ok=True)
+    with open(log, 'w') as f, redirect_stdout(f), new_rng(0):
+        construct(dataset, scenario, dte, model_dir=model_dir, workers=threads, **opts)
+        sys.stdout.flush()
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
+import numba as nb
 import numpy as np
 import scipy.sparse as sps
 
 from scipy.spatial.distance import cdist
-from tqdm import tqdm
 
 
 def estimate_dead_times(spos, rpos, c0, fs, subsample=False):
@@ -14,28 +14,71 @@ def estimate_dead_times(spos, rpos, c0, fs, subsample=False):
     return d
 
 
-def apply_dead_times(ir, dead_times):
-    irm = np.zeros_like(ir)
-    p, m = ir.shape[1:]
-    for i in range(p):
-        for j in range(m):
-            if dead_times[i, j] == 0:
-                irm[:, i, j] = ir[:, i, j]
-            if dead_times[i, j] > 1:
-                irm[dead_times[i, j]:, i, j] = ir[:-dead_times[i, j], i, j]
-            else:
-                irm[:dead_times[i, j], i, j] = ir[-dead_times[i, j]:, i, j]
-    return irm
+def apply_dead_times(ir, dead_times, out=None, order='K'):
+    # shift each channel by its dead time, positive values delay and negative values advance the response
+    # out can be ir itself (e.g. a writable memory map) to apply the dead times in place
+    if out is None:
+        out = np.empty_like(ir, order=order, subok=False)
+    assert out.shape == ir.shape and dead_times.shape == ir.shape[1:]
+    _shift_channels(np.asarray(ir), np.asarray(dead_times, dtype=np.int64), np.asarray(out))
+    return out
 
 
-def impulse_response(sys):
+@nb.njit(parallel=True, cache=True)
+def _shift_channels(ir, dead_times, out):
+    T, p, m = ir.shape
+    for c in nb.prange(p*m):
+        i, j = c // m, c % m
+        d = dead_times[i, j]
+        # iterate against the shift direction, so that in place shifts never read overwritten samples
+        if d >= 0:
+            for t in range(T-1, -1, -1):
+                out[t, i, j] = ir[t-d, i, j] if t >= d else 0
+        else:
+            for t in range(T):
+                out[t, i, j] = ir[t-d, i, j] if t-d < T else 0
+
+
+def impulse_response_blocks(sys, T, block_size=1000, dtype=None):
+    # yield the first T Markov parameters of sys in blocks of at most block_size time steps
+    # each block is a single (multi-threaded) matrix product of the stacked C A^i with the state
     A, B, C, D, _ = sys.to_matrices()
-    y = np.zeros((sys.T, sys.dim_output, sys.dim_input))
+    A, B, C = (M.toarray() if sps.issparse(M) else M for M in (A, B, C))
+    if dtype is None:
+        dtype = np.result_type(A, B, C)
+    elif any(np.iscomplexobj(M) for M in (A, B, C)):
+        dtype = np.promote_types(dtype, np.complex64)
+    A, B, C = (M.astype(dtype, copy=False) for M in (A, B, C))
+    n, p, m = A.shape[0], C.shape[0], B.shape[1]
+
+    y = np.zeros((1, p, m), dtype=dtype)
     if D is not None:
-        y[0] = D.todense() if sps.issparse(D) else D
+        y[0] = D.toarray() if sps.issparse(D) else D
+    yield 0, y.real
+
+    b = max(1, min(block_size, T-1))
+    O = np.empty((b, p, n), dtype=dtype)
+    O[0] = C
+    for i in range(1, b):
+        O[i] = O[i-1] @ A
+    Ab = np.linalg.matrix_power(A, b)
     x = B
-    for i in tqdm(range(1, sys.T), initial=1, total=sys.T, desc=f'n={sys.order}, m={sys.dim_input}, p={sys.dim_output}'):
-        z = np.real(C @ x)
-        y[i] = z.todense() if sps.issparse(z) else z
-        x = A @ x
+    for start in range(1, T, b):
+        k = min(b, T-start)
+        yield start, (O[:k].reshape(-1, n) @ x).reshape(k, p, m).real
+        x = Ab @ x
+
+
+def impulse_response(sys, block_size=1000, dtype=np.float64):
+    y = np.empty((sys.T, sys.dim_output, sys.dim_input), dtype=dtype)
+    for start, block in impulse_response_blocks(sys, sys.T, block_size=block_size, dtype=dtype):
+        y[start:start+len(block)] = block
     return y
+
+
+def impulse_response_error(sys, h, block_size=1000):
+    # Frobenius norm of the difference of h and the impulse response of sys without forming the latter
+    err = 0.
+    for start, block in impulse_response_blocks(sys, len(h), block_size=block_size, dtype=h.dtype):
+        err += np.linalg.norm(h[start:start+len(block)] - block)**2
+    return np.sqrt(err)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import scipy.optimize as spo
+import scipy.sparse as sps
+
+from era_dts import dead_time_extraction
+from era_dts.dead_time_extraction import extract_dead_times, split_dead_times
+from era_dts.utils import estimate_dead_times
+
+
+@pytest.mark.parametrize('method', ['NONE', 'LC', 'DTS'])
+def test_extract_dead_times(method, monkeypatch, tmp_path):
+    rng = np.random.default_rng(0)
+    rpos, spos = rng.uniform(0, 1, size=(3, 3)), rng.uniform(0, 1, size=(2, 3))
+    ir = rng.normal(size=(400, 3, 2)).astype(np.float32)
+    calls = []
+    dead_times = dead_time_extraction.dead_times
+    monkeypatch.setattr(dead_time_extraction, 'dead_times',
+                        lambda *args, **kwargs: calls.append(args) or dead_times(*args, **kwargs))
+    irm, do, di = extract_dead_times(ir, rpos, spos, 48000, method, cache_dir=tmp_path)
+    # the dead times are only computed once
+    assert len(calls) == 1
+    assert do.shape == (3,) and di.shape == (2,)
+    # the split dead times of DTS are fractional, their sums are truncated
+    d = np.add.outer(do, di).astype(int)
+    if method == 'NONE':
+        assert irm is ir and not d.any()
+    else:
+        assert d.min() > 0 and irm.flags.c_contiguous
+        for i, j in np.ndindex(3, 2):
+            assert np.array_equal(irm[:400-d[i, j], i, j], ir[d[i, j]:, i, j])
+            assert not irm[400-d[i, j]:, i, j].any()
+
+
+def split_dead_times_full_lp(deltas):
+    # the complete linear program with one constraint per channel, larger dimension first
+    p, m = deltas.shape
+    D = deltas if p > m else deltas.T
+    q, r = D.shape
+    A = sps.hstack([sps.kron(sps.eye(q), np.ones((r, 1))), sps.kron(np.ones((q, 1)), sps.eye(r))]).tocsr()
+    x = spo.linprog(-np.ones(q+r), A_ub=A, b_ub=D.ravel(), method='highs-ipm')['x']
+    if p > m:
+        do, di = np.split(x, [p])
+        return do - np.min(do), di + np.min(do)
+    else:
+        di, do = np.split(x, [m])
+        return do + np.min(di), di - np.min(di)
+
+
+@pytest.mark.parametrize('transpose', [False, True])
+def test_split_dead_times(transpose, tmp_path):
+    # 32 receivers on a sphere around the origin and 1024 sources on a plane in front of it
+    rng = np.random.default_rng(0)
+    rpos = rng.normal(size=(32, 3))
+    rpos *= 0.1/np.linalg.norm(rpos, axis=1, keepdims=True)
+    y, z = np.meshgrid(np.linspace(-1, 1, 32), np.linspace(-0.5, 1.5, 32))
+    spos = np.stack([np.full(1024, 1.5), y.ravel(), z.ravel()], axis=1)
+    d = estimate_dead_times(rpos, spos, 343, 48000)
+    d = d.T if transpose else d
+    do, di = split_dead_times(d, subsample=True, cache_dir=tmp_path)
+    do_ref, di_ref = split_dead_times_full_lp(d)
+    # the optimum is not unique in general, so the objectives are compared
+    assert np.isclose(np.sum(do) + np.sum(di), np.sum(do_ref) + np.sum(di_ref))
+    assert np.all(np.add.outer(do, di) <= d + 1e-6)
+    # the cached solution is used by the next call
+    assert len(list(tmp_path.glob('*.npy'))) == 1
+    do_cached, di_cached = split_dead_times(d, subsample=True, cache_dir=tmp_path)
+    assert np.array_equal(do_cached, do) and np.array_equal(di_cached, di)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from io import BytesIO
+from pathlib import Path
+from scipy.io import savemat
+from zipfile import ZipFile
+
+from era_dts.downloader import load, process_mird
+
+
+def test_process_mird(tmp_path, monkeypatch):
+    # a small synthetic MIRD archive with T60 = 480 samples and three source positions
+    monkeypatch.chdir(tmp_path)
+    infile = tmp_path / 'raw' / 'MIRD' / 'short_3.zip'
+    infile.parent.mkdir(parents=True)
+    names = [f'Impulse_response_Acoustic_Lab_Bar-Ilan_University_Reverberation_0.010s_3-3-3-8-3-3-3_{r}m_{phi:03d}.mat'
+             for r, phi in ((1, 0), (2, 45), (1, 90))]
+    rng = np.random.default_rng(0)
+    irs = [rng.normal(size=(2000, 8)) for _ in names]
+    with ZipFile(infile, 'w') as zip_file:
+        for name, h in zip(names, irs):
+            buf = BytesIO()
+            savemat(buf, {'impulse_response': h})
+            zip_file.writestr(name, buf.getvalue())
+
+    outdir = process_mird(str(infile), 'download', None)
+    assert outdir == Path('processed') / 'MIRD' / 'short_3'
+    data = load(outdir)
+    assert data['ir'].shape == data['noise'].shape == (480, 8, 3) and data['ir'].dtype == np.float32
+    for i, h in enumerate(irs):
+        assert np.array_equal(data['ir'][..., i], h[629:629+480].astype(np.float32))
+        assert np.array_equal(data['noise'][..., i], h[-480:].astype(np.float32))
+    assert np.allclose(data['spos'], [[0, 1, 1.2], [np.sqrt(2), np.sqrt(2), 1.2], [1, 0, 1.2]])
+    assert data['rpos'].shape == (8, 3) and data['fs'] == 48000
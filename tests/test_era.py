@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from pymor.tools.random import new_rng
+
+from era_dts import perf
+from era_dts.era import RandomizedERAReductor
+from era_dts.utils import impulse_response_error
+
+from .test_fastoperators import dense_hankel
+
+
+rrf_opts = {'block_size': 2, 'power_iterations': 2, 'qr_method': 'shifted_chol_qr', 'error_estimator': 'loo'}
+
+
+def lti_markov_parameters(T=300, p=3, m=4, n=60, seed=0):
+    # Markov parameters of a random stable system with decaying Hankel singular values
+    rng = np.random.default_rng(seed)
+    A = rng.uniform(-0.95, 0.95, n)
+    B, C = rng.normal(size=(n, m)), rng.normal(size=(p, n))
+    return np.einsum('pn,tn,nm->tpm', C, A[np.newaxis]**np.arange(T)[:, np.newaxis], B)
+
+
+@pytest.mark.parametrize('force_stability', [False, True])
+def test_sweep(force_stability):
+    h = lti_markov_parameters()
+    tols = [1e-1, 1e-2, 1e-3]
+    perf.reset()
+    with new_rng(0):
+        era = RandomizedERAReductor(h[1:], 1., feedthrough=h[0], force_stability=force_stability, rrf_opts=rrf_opts)
+        results = list(era.sweep(tols=tols))
+    # the nested models are truncations of a single projected SVD
+    assert perf.phases['svd']['calls'] == 1
+    orders = [rom.order for rom, *_ in results]
+    assert orders == sorted(orders) and len(set(orders)) == len(orders)
+    for tol, (rom, hsv, est, kung) in zip(tols, results):
+        assert len(hsv) == rom.order and np.array_equal(hsv, results[-1][1][:rom.order])
+        assert kung == 2*hsv[-1]
+        assert est < tol
+        assert impulse_response_error(rom, h) / np.linalg.norm(h) < 10*tol
+
+
+def test_checkpoint_resume(tmp_path):
+    h = lti_markov_parameters()
+    tols = [1e-1, 1e-2, 1e-3]
+    checkpoint = tmp_path / 'checkpoint.npz'
+    with new_rng(0):
+        era = RandomizedERAReductor(h[1:], 1., feedthrough=h[0], force_stability=False, rrf_opts=rrf_opts)
+        reference = [(rom.order, est) for rom, _, est, _ in era.sweep(tols=tols)]
+    calls = []
+
+    def interrupt(order):
+        # the run is interrupted after the first tolerance is checkpointed, while the range finder reaches the second
+        calls.append(order)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return 2
+
+    with new_rng(0):
+        era = RandomizedERAReductor(h[1:], 1., feedthrough=h[0], force_stability=False, rrf_opts=rrf_opts)
+        with pytest.raises(KeyboardInterrupt):
+            next(era.sweep(tols=tols, block_size=interrupt, checkpoint=checkpoint))
+    # the state of the random generator is restored from the checkpoint
+    with new_rng(1):
+        era = RandomizedERAReductor(h[1:], 1., feedthrough=h[0], force_stability=False, rrf_opts=rrf_opts)
+        resumed = [(rom.order, est) for rom, _, est, _ in era.sweep(tols=tols, checkpoint=checkpoint, resume=True)]
+    assert [order for order, _ in resumed] == [order for order, _ in reference]
+    assert np.allclose([est for _, est in resumed], [est for _, est in reference])
+
+
+def test_projection():
+    h = lti_markov_parameters(p=12, m=10)
+    with new_rng(0):
+        era = RandomizedERAReductor(h[1:], 1., feedthrough=h[0], num_left=6, num_right=5, rrf_opts=rrf_opts)
+        rom, *_ = next(era.sweep(tols=[1e-2]))
+    # the reduced order model maps the full inputs to the full outputs
+    assert (rom.dim_output, rom.dim_input) == (12, 10)
+    error = impulse_response_error(rom, h) / np.linalg.norm(h)
+    assert 0 < era.projection_errors[0] < 1 and 0 < era.projection_errors[1] < 1
+    assert error < 1e-2 + sum(era.projection_errors)
+
+
+@pytest.mark.parametrize('p,m', [(4, 3), (3, 4)])
+def test_force_stability_hankel(p, m):
+    h = lti_markov_parameters(T=40, p=p, m=m)
+    data = h[1:]
+    assert np.abs(data[-1]).max() > 0
+    era = RandomizedERAReductor(data, 1., force_stability=True, rrf_opts=rrf_opts)
+    # the data padded with zeros, the last block of the data is not replaced by the padding
+    Hd = dense_hankel(data, np.zeros_like(data))
+    H = era._H.H if era._transpose else era._H
+    rng = np.random.default_rng(1)
+    U, V = rng.normal(size=(3, H.source.dim)), rng.normal(size=(3, H.range.dim))
+    assert np.allclose(H.apply(H.source.from_numpy(U)).to_numpy(), U @ Hd.T)
+    assert np.allclose(H.apply_adjoint(H.range.from_numpy(V)).to_numpy(), V @ Hd)
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+import tracemalloc
+
+from era_dts.fastoperators import NumbaHankelOperator
+
+
+def markov_parameters(T, p, m, dtype, seed=0):
+    # exponentially decaying random Markov parameters
+    rng = np.random.default_rng(seed)
+    return (rng.normal(size=(T, p, m)) * np.exp(-5*np.arange(T)/T)[:, np.newaxis, np.newaxis]).astype(dtype)
+
+
+def dense_hankel(c, r):
+    # the reference is assembled in double precision, r[0] is replaced by c[-1]
+    h = np.concatenate([c, r[1:]])
+    h = h.astype(np.promote_types(h.dtype, np.float64))
+    return np.block([[h[i+j] for j in range(len(r))] for i in range(len(c))])
+
+
+def random_vectors(space, dtype, k=4, seed=1):
+    rng = np.random.default_rng(seed)
+    U = rng.normal(size=(k, space.dim))
+    if np.issubdtype(dtype, np.complexfloating):
+        U = U + 1j*rng.normal(size=(k, space.dim))
+    return space.from_numpy(U.astype(dtype))
+
+
+def assert_close(y, y_ref, dtype):
+    rtol = 1e-4 if dtype in (np.float32, np.complex64) else 1e-10
+    assert np.linalg.norm(y - y_ref) <= rtol * np.linalg.norm(y_ref)
+
+
+@pytest.mark.parametrize('accumulation', ['time', 'frequency'])
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('T', [20, 21])
+@pytest.mark.parametrize('p,m', [(3, 2), (2, 3)])
+@pytest.mark.parametrize('max_memory', [None, 1])
+def test_hankel(accumulation, dtype, T, p, m, max_memory):
+    h = markov_parameters(T, p, m, dtype)
+    s = (T + 1) // 2
+    c, r = h[:s], h[s-1:]
+    H = NumbaHankelOperator(c, r=r, accumulation=accumulation, max_memory=max_memory)
+    Hd = dense_hankel(c, r)
+    U, V = random_vectors(H.source, dtype), random_vectors(H.range, dtype)
+    assert_close(H.apply(U).to_numpy(), U.to_numpy() @ Hd.T, dtype)
+    assert_close(H.apply_adjoint(V).to_numpy(), V.to_numpy() @ Hd, dtype)
+    assert_close(H.H.apply(V).to_numpy(), V.to_numpy() @ Hd, dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.complex64, np.complex128])
+def test_hankel_complex_vectors(dtype):
+    h = markov_parameters(21, 3, 2, np.float32 if dtype == np.complex64 else np.float64)
+    c, r = h[:11], h[10:]
+    H = NumbaHankelOperator(c, r=r)
+    Hd = dense_hankel(c, r)
+    U, V = random_vectors(H.source, dtype), random_vectors(H.range, dtype)
+    assert_close(H.apply(U).to_numpy(), U.to_numpy() @ Hd.T, dtype)
+    assert_close(H.apply_adjoint(V).to_numpy(), V.to_numpy() @ Hd, dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.complex128])
+def test_hankel_mixed_precision(dtype):
+    # double precision vectors are applied with the single precision spectrum, which is not cast per call
+    h = markov_parameters(21, 3, 2, np.float32)
+    c, r = h[:11], h[10:]
+    H = NumbaHankelOperator(c, r=r)
+    Hd = dense_hankel(c, r)
+    U, V = random_vectors(H.source, dtype), random_vectors(H.range, dtype)
+    Y, Z = H.apply(U).to_numpy(), H.apply_adjoint(V).to_numpy()
+    assert Y.dtype == dtype and Z.dtype == dtype
+    assert_close(Y, U.to_numpy() @ Hd.T, np.float32)
+    assert_close(Z, V.to_numpy() @ Hd, np.float32)
+    for op in (H, H.H):
+        assert all(C.dtype == np.complex64 for C in op._circulant._spectra.values())
+
+
+def test_hankel_complex_data():
+    rng = np.random.default_rng(0)
+    h = rng.normal(size=(15, 2, 3)) + 1j*rng.normal(size=(15, 2, 3))
+    c, r = h[:8], h[7:]
+    H = NumbaHankelOperator(c, r=r)
+    Hd = dense_hankel(c, r)
+    U, V = random_vectors(H.source, np.complex128), random_vectors(H.range, np.complex128)
+    assert_close(H.apply(U).to_numpy(), U.to_numpy() @ Hd.T, np.complex128)
+    assert_close(H.apply_adjoint(V).to_numpy(), V.to_numpy() @ Hd.conj(), np.complex128)
+
+
+def test_spectrum_cache(tmp_path):
+    h = markov_parameters(21, 3, 2, np.float32)
+    H = NumbaHankelOperator(h[:11], r=h[10:], spectrum_cache=tmp_path)
+    # the spectrum is kept and not copied on lookup
+    assert H._circulant._spectrum() is H._circulant._spectrum()
+    U = random_vectors(H.source, np.float32)
+    Y = H.apply(U).to_numpy()
+    # a new operator reads the spectrum from disk
+    H = NumbaHankelOperator(h[:11], r=h[10:], spectrum_cache=tmp_path)
+    assert len(list(tmp_path.glob('*.npy'))) == 1
+    assert np.array_equal(H.apply(U).to_numpy(), Y)
+
+
+def test_hankel_construction_memory():
+    # neither the data nor a padded or rolled copy of it is allocated
+    h = markov_parameters(20001, 4, 8, np.float32)
+    s = (len(h) + 1) // 2
+    tracemalloc.start()
+    H = NumbaHankelOperator(h[:s], r=h[s-1:])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 0.01 * h.nbytes
+    assert H.H.source == H.range
+
+
+def test_hankel_spectrum_memory():
+    # the spectrum of the zero padding of force_stability is twice as long as the one of the unforced operator,
+    # a zero padded copy of the data on top of it would add at least twice the size of the data
+    h = markov_parameters(20001, 4, 8, np.float32)
+    s = (len(h) + 1) // 2
+    peaks = []
+    for c, r in ((h[:s], h[s-1:]), (h, np.broadcast_to(np.zeros((), dtype=h.dtype), h.shape))):
+        H = NumbaHankelOperator(c, r=r)
+        tracemalloc.start()
+        C = H._circulant._spectrum()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert peaks[-1] < 1.5 * C.nbytes
+    assert peaks[1] < 2.2 * peaks[0]
+
+
+@pytest.mark.parametrize('accumulation', ['time', 'frequency'])
+def test_hankel_processes(accumulation):
+    h = markov_parameters(21, 3, 4, np.float64)
+    H = NumbaHankelOperator(h[:11], r=h[10:], accumulation=accumulation)
+    Hp = NumbaHankelOperator(h[:11], r=h[10:], accumulation=accumulation, processes=2)
+    # the second call needs larger shared memory segments, complex vectors use the full spectrum
+    for k, dtype in ((2, np.float64), (6, np.float64), (3, np.complex128)):
+        U, V = random_vectors(H.source, dtype, k=k), random_vectors(H.range, dtype, k=k)
+        assert_close(Hp.apply(U).to_numpy(), H.apply(U).to_numpy(), dtype)
+        assert_close(Hp.apply_adjoint(V).to_numpy(), H.apply_adjoint(V).to_numpy(), dtype)
+    # the spectra are only kept in the shared memory segments the workers attach to
+    for op in (Hp, Hp.H):
+        circulant = op._circulant
+        for full, C in circulant._spectra.items():
+            shm = circulant._shm[('spectrum', full)]
+            assert np.shares_memory(C, np.ndarray(shm.size, dtype=np.uint8, buffer=shm.buf))
@@ -0,0 +1,24 @@
+import json
+
+from importlib.metadata import PackageNotFoundError
+
+from era_dts import perf
+
+
+def test_write(tmp_path, monkeypatch):
+    def version(pkg):
+        raise PackageNotFoundError(pkg)
+
+    # e.g. run from a source checkout
+    monkeypatch.setattr(perf, 'version', version)
+    perf.reset()
+    with perf.phase('sampling'):
+        perf.count('matvecs', 5)
+        perf.record('sampling', samples=5, time=0.1)
+    perf.write(tmp_path / 'perf.json', scenario='test')
+    result = json.loads((tmp_path / 'perf.json').read_text())
+    assert result['info']['scenario'] == 'test'
+    assert result['info']['versions']['era_dts'] is None
+    assert result['phases']['sampling']['calls'] == 1
+    assert result['counters']['matvecs'] == 5
+    assert result['series']['sampling'] == [{'samples': 5, 'time': 0.1}]
@@ -0,0 +1,35 @@
+import numpy as np
+
+from pymor.models.iosys import LTIModel
+
+from era_dts import results
+
+
+def random_rom(order, p=3, m=2, seed=0):
+    rng = np.random.default_rng(seed)
+    A, B, C, D = rng.normal(size=(order, order)), rng.normal(size=(order, m)), rng.normal(size=(p, order)), \
+        rng.normal(size=(p, m))
+    return LTIModel.from_matrices(A, B, C, D, sampling_time=0.5)
+
+
+def test_store(tmp_path):
+    path = tmp_path / 'results.h5'
+    metrics = dict(err_true=1., err_relative=0.1, err_est=0.2, err_kung=0.3, elapsed=4.)
+    with results.create(path, dataset='mit', scenario='s', shape=(10, 3, 2), num_left=2, num_right=None,
+                        projection_errors=np.array([0.01, 0.])) as f:
+        for order in (4, 8):
+            results.append(f, random_rom(order), np.arange(order, 0, -1.), **metrics)
+    # an order that is computed again after resuming replaces its previous entry
+    with results.create(path, resume=True, num_left=2, num_right=None, projection_errors=np.array([0.01, 0.])) as f:
+        results.append(f, random_rom(8, seed=1), np.arange(8, 0, -1.), **metrics | {'err_est': 0.5})
+
+    meta = results.load_metadata(path)
+    assert meta['dataset'] == 'mit' and meta['num_left'] == 2 and 'num_right' not in meta
+    assert np.array_equal(meta['projection_errors'], [0.01, 0.])
+    assert np.array_equal(meta['orders'], [4, 8])
+    assert np.array_equal(meta['err_est'], [0.2, 0.5])
+    rom, hsv = results.load_rom(path, 8)
+    A, B, C, D, _ = random_rom(8, seed=1).to_matrices()
+    assert rom.order == 8 and rom.sampling_time == 0.5 and np.array_equal(hsv, np.arange(8, 0, -1.))
+    for X, Y in zip(rom.to_matrices()[:4], (A, B, C, D)):
+        assert np.allclose(X, Y, rtol=1e-6)
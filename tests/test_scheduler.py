@@ -0,0 +1,24 @@
+import numpy as np
+
+from era_dts import downloader
+from era_dts.scheduler import parse_job, predict_memory
+
+
+def test_parse_job():
+    assert parse_job('miracle/A1-C1-dts') == ('MIRACLE', 'A1-C1', 'DTS')
+
+
+def test_predict_memory():
+    assert predict_memory(1000, 4, 8, 4, max_order=10) < predict_memory(1000, 4, 8, 4, max_order=100)
+    assert predict_memory(1000, 4, 8, 4, max_order=100) < predict_memory(1000, 4, 8, 4)
+    # the order is bounded by the rank of the Hankel matrix
+    assert predict_memory(1000, 4, 8, 4, max_order=10**6) == predict_memory(1000, 4, 8, 4)
+    # the bases live in the range of the transposed Hankel operator if there are more inputs than outputs
+    assert predict_memory(1000, 4, 8, 4, max_order=10) == predict_memory(1000, 8, 4, 4, max_order=10)
+
+
+def test_fetch_shape(tmp_path, monkeypatch):
+    np.save(tmp_path / 'ir.npy', np.zeros((10, 3, 4096), dtype=np.float32))
+    monkeypatch.setattr(downloader, 'fetch_path', lambda dataset, scenario: tmp_path)
+    assert downloader.fetch_shape('MIRACLE', 'A1') == (10, 3, 4096)
+    assert downloader.fetch_shape('MIRACLE', 'A1-C1') == (10, 3, 1024)
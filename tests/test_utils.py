@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from era_dts.utils import apply_dead_times
+
+
+def shifted(ir, d):
+    # reference shift of each channel, positive dead times delay the response, shifts beyond T leave zeros
+    out = np.zeros_like(ir)
+    T = len(ir)
+    for (i, j), dij in np.ndenumerate(d):
+        if dij >= 0:
+            out[dij:, i, j] = ir[:max(T-dij, 0), i, j]
+        else:
+            out[:max(T+dij, 0), i, j] = ir[-dij:, i, j]
+    return out
+
+
+@pytest.mark.parametrize('order', ['K', 'C', 'F'])
+def test_apply_dead_times(order):
+    ir = np.random.default_rng(0).normal(size=(10, 2, 3))
+    d = np.array([[0, 1, -1], [3, -4, 12]])
+    out = apply_dead_times(ir, d, order=order)
+    assert np.array_equal(out, shifted(ir, d))
+    assert out.flags.f_contiguous if order == 'F' else out.flags.c_contiguous
+
+
+def test_apply_dead_times_in_place():
+    ir = np.random.default_rng(0).normal(size=(10, 2, 3))
+    d = np.array([[0, 1, -1], [3, -4, 12]])
+    ref = shifted(ir, d)
+    assert apply_dead_times(ir, d, out=ir) is ir
+    assert np.array_equal(ir, ref)